@@ -1,56 +1,130 @@
 import os
-import dspy
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
-from langchain_google_genai import ChatGoogleGenerativeAI
-from tavily import TavilyClient
+import threading
 
 # --- Load Environment Variables ---
+# Before any app.core import: recording, embedding_cache, shared_cache etc.
+# read their settings (CASSETTE_MODE, EMBEDDING_CACHE_DIR, ...) at import.
 from dotenv import load_dotenv
 # This path goes up two directories (app -> backend) and finds .env
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 load_dotenv(dotenv_path)
 
+from app.core.procstats import memory_checkpoint, memory_breakdown
+memory_checkpoint("start")
+import dspy
+from qdrant_client import QdrantClient
+from sentence_transformers import SentenceTransformer
+from langchain_google_genai import ChatGoogleGenerativeAI
+from tavily import TavilyClient
+from app.core.recording import CASSETTE_MODE, cassette
+from app.core.embedding_cache import EmbeddingCache
+memory_checkpoint("imports (dspy, qdrant, torch, langchain, tavily)")
+
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 VECTORDB_URL = os.environ.get("VECTORDB_URL")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY")
 
-if not all([GOOGLE_API_KEY, VECTORDB_URL, QDRANT_API_KEY, TAVILY_API_KEY]):
+# In replay mode every external call is answered from the cassette,
+# so the real network clients are never built.
+REPLAYING = CASSETTE_MODE == "replay"
+
+if not REPLAYING and not all([GOOGLE_API_KEY, VECTORDB_URL, QDRANT_API_KEY, TAVILY_API_KEY]):
     print("WARNING: One or more environment variables are missing from .env")
     print(f"GOOGLE_API_KEY: {'SET' if GOOGLE_API_KEY else 'MISSING'}")
     print(f"VECTORDB_URL: {'SET' if VECTORDB_URL else 'MISSING'}")
     print(f"QDRANT_API_KEY: {'SET' if QDRANT_API_KEY else 'MISSING'}")
     print(f"TAVILY_API_KEY: {'SET' if TAVILY_API_KEY else 'MISSING'}")
 
+# --- Per-process network clients ---
+# gunicorn preloads this module in the master and then forks (see
+# gunicorn.conf.py). Only the model weights should be shared that way; a
+# network client (httpx/gRPC pools, sockets) built before the fork would be
+# inherited by every worker. So network clients are built lazily, on first
+# use in each process.
+
+class PerProcess:
+    """Proxy that builds `factory()` on first use in each process."""
+    def __init__(self, factory, name: str):
+        self._factory = factory
+        self._name = name
+        self._pid = None
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._instance = self._factory()
+                    self._pid = os.getpid()
+                    print(f"--- {self._name} Initialized (pid {self._pid}) ---")
+        return self._instance
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+def per_process_chat_model(factory, name: str):
+    """A chat model built per process, as a Runnable so `prompt | llm` keeps working."""
+    from langchain_core.runnables import RunnableLambda
+    holder = PerProcess(factory, name)
+
+    async def ainvoke(prompt_value):
+        return await holder.get().ainvoke(prompt_value)
+
+    return RunnableLambda(lambda prompt_value: holder.get().invoke(prompt_value), afunc=ainvoke, name=name)
+
 # --- 1. LangChain Client (for main generation) ---
-llm_gemini = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    google_api_key=GOOGLE_API_KEY,
-    temperature=0.0
-)
-print("--- LangChain Gemini Client Initialized ---")
+# The lite model is the cheap first tier of the generation cascade
+# (see app/services/cascade.py); llm_gemini is the tier it escalates to.
+GEMINI_LITE_MODEL = os.environ.get("GEMINI_LITE_MODEL", "gemini-2.5-flash-lite")
+
+if REPLAYING:
+    llm_gemini = None
+    llm_gemini_lite = None
+else:
+    llm_gemini = per_process_chat_model(lambda: ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0.0
+    ), "LangChain Gemini Client")
+    llm_gemini_lite = per_process_chat_model(lambda: ChatGoogleGenerativeAI(
+        model=GEMINI_LITE_MODEL,
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0.0
+    ), "LangChain Gemini Lite Client")
+memory_checkpoint("gemini clients")
 
 # --- 2. Qdrant Client & Embedding Model (for RAG) ---
-try:
-    qdrant_client = QdrantClient(
+# Construction errors now surface on the first call, where the KB search
+# already logs them and falls back to the web.
+if REPLAYING or not VECTORDB_URL:
+    print("--- Qdrant Client not configured ---")
+    qdrant_client = None
+else:
+    qdrant_client = PerProcess(lambda: QdrantClient(
         url=VECTORDB_URL, 
         api_key=QDRANT_API_KEY,
         timeout=10 # Set a timeout
-    )
-    print("--- Qdrant Client Initialized ---")
-except Exception as e:
-    print(f"--- Qdrant Client FAILED to initialize: {e} ---")
-    qdrant_client = None
+    ), "Qdrant Client")
+memory_checkpoint("qdrant client")
 
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2" # Must match ingest script
+embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
 print("--- SentenceTransformer Model Loaded ---")
 
+# Disk-backed cache shared with the ingestion script (app/core/embedding_cache.py).
+embedding_cache = EmbeddingCache(embedding_model, EMBEDDING_MODEL_NAME)
+memory_checkpoint("embedding model + cache")
+
 
 # --- 3. Tavily Client (for MCP/Web Search) ---
 # This provides the *functionality* of your MCP pipeline.
-tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-print("--- Tavily Client Initialized (Simulating MCP) ---")
+if REPLAYING:
+    tavily_client = None
+else:
+    tavily_client = PerProcess(lambda: TavilyClient(api_key=TAVILY_API_KEY), "Tavily Client (Simulating MCP)")
+memory_checkpoint("tavily client")
 
 
 # --- 4. DSPy Client (for Feedback/Refinement) ---
@@ -70,4 +144,19 @@ except ImportError:
 except Exception as e:
     print(f"--- DSPy Client FAILED to initialize: {e} ---")
     dspy_gemini_lm = None
+memory_checkpoint("dspy lm")
+
+
+# --- 5. Record/Replay (offline benchmarks, see app/core/recording.py) ---
+if cassette is not None:
+    llm_gemini = cassette.wrap_chat_model(llm_gemini, "gemini")
+    llm_gemini_lite = cassette.wrap_chat_model(llm_gemini_lite, "gemini_lite")
+    qdrant_client = cassette.wrap_client(qdrant_client, "qdrant", methods=("search", "query_points", "scroll"))
+    tavily_client = cassette.wrap_client(tavily_client, "tavily", methods=("search",))
+    if dspy_gemini_lm is not None:
+        dspy_gemini_lm = cassette.wrap_dspy_lm(dspy_gemini_lm, "dspy")
+        dspy.configure(lm=dspy_gemini_lm)
+    print(f"--- Clients wrapped for cassette {CASSETTE_MODE} ---")
 
+for section in memory_breakdown():
+    print(f"--- Memory: {section['section']}: +{section['rss_delta_bytes'] / 2**20:.1f} MB RSS ---")
@@ -0,0 +1,189 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+# --- Persistent, content-addressed embedding cache ---
+# Shared by scripts/ingest_math_dataset.py and the API, so a text is only
+# ever embedded once per model. On disk, per model fingerprint:
+#
+#   vectors.f32  append-only float32 matrix, one row per text (memory-mapped)
+#   index.txt    append-only "<sha256(text)> <row>" lines
+#
+# The directory name includes a fingerprint of the model's actual output,
+# so swapping or upgrading the model starts a fresh cache automatically.
+# Writers (several workers, the ingestion script) take an flock, append the
+# vector first and the index line second, so readers never see an index
+# entry without its vector.
+# If the cache directory can't be used (e.g. a read-only code tree), the
+# cache disables itself and every call goes straight to the model.
+
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), '..', '..', 'embedding_cache')
+)
+_FINGERPRINT_TEXT = "embedding cache fingerprint: 2 + 2 = 4"
+
+def model_fingerprint(model, model_name: str) -> str:
+    """Name plus a hash of a probe embedding (changes with weights/version)."""
+    probe = np.asarray(model.encode(_FINGERPRINT_TEXT), dtype=np.float32)
+    digest = hashlib.sha256(np.round(probe, 4).tobytes()).hexdigest()[:12]
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    return f"{safe_name}-{probe.shape[0]}d-{digest}"
+
+class EmbeddingCache:
+    def __init__(self, model, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.dim = model.get_sentence_embedding_dimension()
+        start = time.perf_counter()
+        self.dir = os.path.abspath(os.path.join(cache_dir, model_fingerprint(model, model_name)))
+        # Per-text encode cost estimate until we have timed real misses.
+        self._probe_seconds = time.perf_counter() - start
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.txt")
+        self.lock_path = os.path.join(self.dir, ".lock")
+        self._row_bytes = self.dim * 4
+
+        self._lock = threading.Lock()
+        self._rows = {}          # sha256 -> row
+        self._index_offset = 0   # bytes of index.txt already read
+        self._matrix = None      # np.memmap over vectors.f32
+        self._mapped_rows = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0  # time spent encoding misses
+        self.enabled = True
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            open(self.lock_path, 'a').close()
+            self._refresh_index()
+            print(f"--- Embedding cache: {len(self._rows)} vectors in {self.dir} ---")
+        except OSError as e:
+            self._disable(e)
+
+    def _disable(self, error: OSError):
+        self.enabled = False
+        print(f"--- Embedding cache: DISABLED, encoding without a cache ({error}) ---")
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _refresh_index(self):
+        """Reads index lines appended (by any process) since the last refresh."""
+        try:
+            with open(self.index_path, 'rb') as f:
+                f.seek(self._index_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Partially written, read it next time.
+                    self._index_offset += len(line)
+                    digest, row = line.split()
+                    self._rows[digest.decode()] = int(row)
+        except FileNotFoundError:
+            pass
+
+    def _row(self, row: int) -> np.ndarray:
+        if row >= self._mapped_rows:
+            rows = os.path.getsize(self.vectors_path) // self._row_bytes
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+            self._mapped_rows = rows
+        return self._matrix[row]
+
+    def _append(self, digests: list, vectors: np.ndarray):
+        lock_file = open(self.lock_path, 'a')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh_index()
+            new = [(d, v) for d, v in zip(digests, vectors) if d not in self._rows]
+            if not new:
+                return
+            # Drop a partial row left by a writer that crashed mid-append.
+            if os.path.exists(self.vectors_path):
+                size = os.path.getsize(self.vectors_path)
+                if size % self._row_bytes:
+                    os.truncate(self.vectors_path, size - size % self._row_bytes)
+            with open(self.vectors_path, 'ab') as f:
+                first_row = f.tell() // self._row_bytes
+                f.write(np.ascontiguousarray([v for _, v in new], dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, 'ab') as f:
+                f.write("".join(f"{d} {first_row + i}\n" for i, (d, _) in enumerate(new)).encode())
+            self._refresh_index()
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def encode(self, texts, **encode_kwargs) -> np.ndarray:
+        """
+        Drop-in for SentenceTransformer.encode: a str returns one vector
+        (a read-only view into the memory map on a hit), a list returns a
+        (len, dim) float32 matrix. Only missing texts are sent to the model.
+        """
+        if not self.enabled:
+            return self._encode_uncached(texts, **encode_kwargs)
+        try:
+            return self._encode_cached(texts, **encode_kwargs)
+        except OSError as e:
+            self._disable(e)
+            return self._encode_uncached(texts, **encode_kwargs)
+
+    def _encode_uncached(self, texts, **encode_kwargs) -> np.ndarray:
+        count = 1 if isinstance(texts, str) else len(texts)
+        start = time.perf_counter()
+        vectors = np.asarray(self.model.encode(texts, **encode_kwargs), dtype=np.float32)
+        self.encode_seconds += time.perf_counter() - start
+        self.misses += count
+        return vectors
+
+    def _encode_cached(self, texts, **encode_kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        digests = [self.key(t) for t in texts]
+
+        with self._lock:
+            missing = {d: t for d, t in zip(digests, texts) if d not in self._rows}
+            if missing:
+                self._refresh_index()
+                missing = {d: t for d, t in missing.items() if d not in self._rows}
+
+            if missing:
+                start = time.perf_counter()
+                encoded = np.asarray(
+                    self.model.encode(list(missing.values()), **encode_kwargs),
+                    dtype=np.float32
+                )
+                self.encode_seconds += time.perf_counter() - start
+                self._append(list(missing.keys()), encoded)
+
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+            if single:
+                return self._row(self._rows[digests[0]])
+            return np.stack([self._row(self._rows[d]) for d in digests])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        avg_encode = self.encode_seconds / self.misses if self.misses else self._probe_seconds
+        return {
+            "enabled": self.enabled,
+            "vectors": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            # Estimated from the average cost of the encodes we did run.
+            "saved_encode_seconds": self.hits * avg_encode,
+            "path": self.dir,
+        }
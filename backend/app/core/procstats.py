@@ -0,0 +1,71 @@
+import os
+import resource
+
+# --- Process memory stats ---
+# RSS counts shared (copy-on-write) pages in every worker, so with a
+# preloaded model it over-reports. PSS splits shared pages between the
+# processes using them, which is the number to add up across workers.
+
+def _read_kb_fields(path: str, fields: tuple) -> dict:
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    values[name] = int(rest.split()[0]) * 1024
+    except (FileNotFoundError, PermissionError, ValueError):
+        pass
+    return values
+
+def memory_stats() -> dict:
+    """
+    Returns {"pid", "rss_bytes", "pss_bytes", "shared_bytes"} for this process.
+    PSS/shared are None where /proc is not available (e.g. macOS).
+    """
+    status = _read_kb_fields("/proc/self/status", ("VmRSS",))
+    rollup = _read_kb_fields("/proc/self/smaps_rollup", ("Pss", "Shared_Clean", "Shared_Dirty"))
+
+    rss = status.get("VmRSS")
+    if rss is None:
+        # Peak RSS (kilobytes on Linux, bytes on macOS) is the best we can do.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    shared = None
+    if "Shared_Clean" in rollup or "Shared_Dirty" in rollup:
+        shared = rollup.get("Shared_Clean", 0) + rollup.get("Shared_Dirty", 0)
+
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": rss,
+        "pss_bytes": rollup.get("Pss"),
+        "shared_bytes": shared,
+    }
+
+def current_rss_bytes() -> int:
+    return memory_stats()["rss_bytes"]
+
+# --- Startup memory breakdown ---
+# app.core.clients calls memory_checkpoint() after loading each client, so
+# memory_breakdown() can attribute startup RSS/PSS growth to each one.
+# With gunicorn's preload_app this runs once, in the master process.
+
+_checkpoints = []
+
+def memory_checkpoint(label: str):
+    """Records this process's memory after `label` was loaded."""
+    _checkpoints.append((label, memory_stats()))
+
+def memory_breakdown() -> list:
+    """[{"section", "rss_delta_bytes", "pss_delta_bytes"}] between consecutive checkpoints."""
+    breakdown = []
+    for (_, previous), (label, current) in zip(_checkpoints, _checkpoints[1:]):
+        pss_delta = None
+        if current["pss_bytes"] is not None and previous["pss_bytes"] is not None:
+            pss_delta = current["pss_bytes"] - previous["pss_bytes"]
+        breakdown.append({
+            "section": label,
+            "rss_delta_bytes": current["rss_bytes"] - previous["rss_bytes"],
+            "pss_delta_bytes": pss_delta,
+        })
+    return breakdown
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter, deque
+
+# --- On-demand profiling for live workers ---
+# Nothing here runs until an admin asks for it:
+#
+#   * sample_stacks() is a pure-Python sampling profiler. For N seconds it
+#     reads every thread's current frame (sys._current_frames) and counts
+#     the stacks, returned in "collapsed" format (one "a;b;c count" line
+#     per stack), which flamegraph.pl / speedscope render directly.
+#   * AllocationTracker snapshots tracemalloc around each request and keeps
+#     the top allocation sites of the last few requests. tracemalloc itself
+#     is only started while tracking is on (it slows allocations down).
+#
+# Profiles cover the worker that served the admin request only.
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # unset: admin endpoints are disabled
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+TRACEMALLOC_REQUESTS = os.environ.get("TRACEMALLOC_REQUESTS", "0") == "1"
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", "10"))
+TRACEMALLOC_TOP = int(os.environ.get("TRACEMALLOC_TOP", "10"))
+
+class ProfilerBusy(Exception):
+    """A profile is already running in this worker."""
+
+_profile_lock = threading.Lock()
+
+def _frame_label(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+def sample_stacks(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> dict:
+    """
+    Samples every thread's stack for `seconds` (capped at PROFILE_MAX_SECONDS).
+    Returns {"collapsed": str, "samples": int, "seconds": float, "interval": float}.
+    Raises ProfilerBusy if another profile is running.
+    """
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = max(interval, 0.001)
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        own_thread = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        elapsed = time.perf_counter() - start
+    finally:
+        _profile_lock.release()
+
+    print(f"--- Profiler: {samples} samples over {elapsed:.1f}s, {len(stacks)} distinct stacks ---")
+    return {
+        "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        "samples": samples,
+        "seconds": elapsed,
+        "interval": interval,
+    }
+
+class AllocationTracker:
+    """
+    Per-request tracemalloc diffs. Requests run concurrently on the event
+    loop, so a diff can include allocations made by overlapping requests;
+    use it on a quiet worker or read it as "allocated while X ran".
+    """
+    def __init__(self, enabled: bool = TRACEMALLOC_REQUESTS, frames: int = TRACEMALLOC_FRAMES,
+                 top: int = TRACEMALLOC_TOP, history: int = 20):
+        self.enabled = False
+        self.frames = frames
+        self.top = top
+        self.reports = deque(maxlen=history)
+        self._lock = threading.Lock()
+        if enabled:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+            self.enabled = True
+        print(f"--- Profiler: Tracking allocations per request ({self.frames} frames) ---")
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        print("--- Profiler: Allocation tracking stopped ---")
+
+    def snapshot(self):
+        if not self.enabled or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.take_snapshot()
+
+    def record(self, label: str, before):
+        after = self.snapshot()
+        if before is None or after is None:
+            return
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        growth = [stat for stat in diff if stat.size_diff > 0]
+        self.reports.append({
+            "request": label,
+            "at": time.time(),
+            "allocated_bytes": sum(stat.size_diff for stat in growth),
+            "top": [
+                {
+                    "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in growth[:self.top]
+            ],
+        })
+
+    def stats(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "enabled": self.enabled,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "requests": list(self.reports),
+        }
+
+allocation_tracker = AllocationTracker()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+# --- Record/Replay for external clients ---
+# Wraps the Gemini (LangChain + DSPy), Qdrant and Tavily clients so their
+# responses can be recorded once to a cassette file and then replayed
+# offline. Used by the benchmarks in backend/benchmarks.
+#
+#   CASSETTE_MODE=off     normal operation (default, nothing is wrapped)
+#   CASSETTE_MODE=record  call the real services and save every response
+#   CASSETTE_MODE=replay  never touch the network, answer from the cassette
+#
+#   REPLAY_LATENCY=instant   return immediately (measures our own overhead)
+#   REPLAY_LATENCY=recorded  sleep for the recorded latency (simulates prod)
+
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.environ.get(
+    "CASSETTE_PATH",
+    os.path.join(os.path.dirname(__file__), '..', '..', 'cassettes', 'default.json')
+)
+REPLAY_LATENCY = os.environ.get("REPLAY_LATENCY", "instant")
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+class AttrDict(dict):
+    """A dict that also allows attribute access (stands in for SDK result objects)."""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+def to_jsonable(obj):
+    """Converts SDK responses (pydantic models, numpy arrays, ...) to plain JSON types."""
+    if hasattr(obj, "model_dump"):
+        return to_jsonable(obj.model_dump(mode="json"))
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+def from_jsonable(obj):
+    """Inverse of to_jsonable for replay: dicts become AttrDicts."""
+    if isinstance(obj, dict):
+        return AttrDict({k: from_jsonable(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [from_jsonable(v) for v in obj]
+    return obj
+
+def _round_floats(obj, digits: int = 4):
+    if isinstance(obj, float):
+        return round(obj, digits)
+    if isinstance(obj, dict):
+        return {k: _round_floats(v, digits) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_round_floats(v, digits) for v in obj]
+    return obj
+
+class Cassette:
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE, latency: str = REPLAY_LATENCY):
+        self.path = os.path.abspath(path)
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.interactions = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.interactions = json.load(f).get("interactions", {})
+        elif mode == "replay":
+            print(f"--- Cassette: WARNING, {self.path} not found. Every call will miss. ---")
+        print(f"--- Cassette: mode={mode}, {len(self.interactions)} interactions ({self.path}) ---")
+
+    @staticmethod
+    def make_key(name: str, method: str, payload) -> str:
+        # Floats are rounded so query vectors that differ in the last bits
+        # (different BLAS/CPU) still hit the same recording.
+        blob = json.dumps([name, method, _round_floats(to_jsonable(payload))], sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"interactions": self.interactions}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def record(self, key: str, name: str, method: str, response, latency: float):
+        with self._lock:
+            self.interactions[key] = {
+                "client": name,
+                "method": method,
+                "latency_seconds": latency,
+                "response": to_jsonable(response),
+            }
+            self.save()
+
+    def lookup(self, key: str, name: str, method: str) -> dict:
+        entry = self.interactions.get(key)
+        if entry is None:
+            raise CassetteMiss(f"No recorded {name}.{method} call for this request ({key[:12]}).")
+        return entry
+
+    def replay(self, key: str, name: str, method: str):
+        entry = self.lookup(key, name, method)
+        if self.latency == "recorded":
+            time.sleep(entry["latency_seconds"])
+        return from_jsonable(entry["response"])
+
+    async def areplay(self, key: str, name: str, method: str):
+        entry = self.lookup(key, name, method)
+        if self.latency == "recorded":
+            await asyncio.sleep(entry["latency_seconds"])
+        return from_jsonable(entry["response"])
+
+    def call(self, name: str, method: str, payload, fn):
+        """Records or replays one synchronous call. `fn` performs the real call."""
+        key = self.make_key(name, method, payload)
+        if self.mode == "replay":
+            return self.replay(key, name, method)
+        start = time.perf_counter()
+        response = fn()
+        self.record(key, name, method, response, time.perf_counter() - start)
+        return response
+
+    async def acall(self, name: str, method: str, payload, afn):
+        key = self.make_key(name, method, payload)
+        if self.mode == "replay":
+            return await self.areplay(key, name, method)
+        start = time.perf_counter()
+        response = await afn()
+        self.record(key, name, method, response, time.perf_counter() - start)
+        return response
+
+    # --- Client wrappers ---
+
+    def wrap_chat_model(self, llm, name: str):
+        """
+        Wraps a LangChain chat model. Returns a Runnable, so `prompt | llm`
+        chains keep working; responses come back as AIMessages.
+        """
+        from langchain_core.messages import AIMessage
+        from langchain_core.runnables import RunnableLambda
+
+        # `name` identifies the model; `llm` itself is None in replay mode.
+        def payload_for(prompt_value):
+            text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+            return {"prompt": text}
+
+        def invoke(prompt_value):
+            content = self.call(name, "invoke", payload_for(prompt_value),
+                                lambda: llm.invoke(prompt_value).content)
+            return AIMessage(content=content)
+
+        async def ainvoke(prompt_value):
+            async def real_call():
+                return (await llm.ainvoke(prompt_value)).content
+            content = await self.acall(name, "invoke", payload_for(prompt_value), real_call)
+            return AIMessage(content=content)
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=f"cassette:{name}")
+
+    def wrap_client(self, client, name: str, methods: tuple):
+        """Wraps a plain SDK client (Qdrant, Tavily) by method name."""
+        return CassetteProxy(client, self, name, methods)
+
+    def wrap_dspy_lm(self, lm, name: str):
+        """
+        Wraps a dspy.LM. DSPy requires a real LM instance, so we re-class a
+        shallow copy instead of proxying it.
+        """
+        import copy
+
+        cassette = self
+        base = type(lm)
+
+        class CassetteLM(base):
+            def __call__(self, prompt=None, messages=None, **kwargs):
+                payload = {"model": self.model, "prompt": prompt, "messages": messages, "kwargs": kwargs}
+                return cassette.call(name, "__call__", payload,
+                                     lambda: base.__call__(self, prompt=prompt, messages=messages, **kwargs))
+
+        wrapped = copy.copy(lm)
+        wrapped.__class__ = CassetteLM
+        return wrapped
+
+class CassetteProxy:
+    def __init__(self, target, cassette: Cassette, name: str, methods: tuple):
+        self._target = target
+        self._cassette = cassette
+        self._name = name
+        self._methods = set(methods)
+
+    def __getattr__(self, attr):
+        if attr not in self._methods:
+            if self._target is None:
+                raise AttributeError(f"{self._name}.{attr} is not available in replay mode")
+            return getattr(self._target, attr)
+
+        def recorded_method(*args, **kwargs):
+            return self._cassette.call(
+                self._name, attr, {"args": args, "kwargs": kwargs},
+                lambda: getattr(self._target, attr)(*args, **kwargs)
+            )
+        return recorded_method
+
+cassette = Cassette() if CASSETTE_MODE in ("record", "replay") else None
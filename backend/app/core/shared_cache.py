@@ -0,0 +1,224 @@
+import os
+import json
+import atexit
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+
+# --- Node-local shared cache (SQLite) ---
+# Every worker process on a node opens the same SQLite file (WAL mode), so a
+# guardrail verdict, web result or answer cached by one worker is a hit for
+# all the others. It also holds counters and per-worker memory stats so the
+# /stats endpoint shows the whole node, not just the worker that answered.
+# The cache is best-effort: any SQLite error is logged and treated as a miss.
+# Counters never write on the request path: incr()/observe() (and hit/miss
+# counts on reads) are buffered in memory and written in one transaction
+# by flush_counters() (with the periodic worker stats report, before
+# counters are read, and at exit).
+
+SHARED_CACHE_PATH = os.environ.get(
+    "SHARED_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "math_agent_shared_cache.sqlite")
+)
+SHARED_CACHE_TTL = int(os.environ.get("SHARED_CACHE_TTL", "86400"))  # 1 day
+# Set to 0 to bypass the key/value cache (e.g. benchmarks); counters still work.
+SHARED_CACHE_ENABLED = os.environ.get("SHARED_CACHE_ENABLED", "1") != "0"
+# Expired rows are only skipped on read; maybe_purge() deletes them at most this often.
+SHARED_CACHE_PURGE_INTERVAL = float(os.environ.get("SHARED_CACHE_PURGE_INTERVAL", "600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    stats TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+class SharedCache:
+    def __init__(self, path: str = SHARED_CACHE_PATH, default_ttl: int = SHARED_CACHE_TTL,
+                 enabled: bool = SHARED_CACHE_ENABLED):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self._local = threading.local()
+        self._pending = Counter()  # counter increments not yet in the counters table
+        self._pending_lock = threading.Lock()
+        self._last_purge = 0.0
+        atexit.register(self.flush_counters)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, and never reuse one across a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update((part or "").encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    @classmethod
+    def question_key(cls, question: str) -> str:
+        """
+        The key for per-question entries (answers, web results, guardrail
+        verdicts): case and whitespace don't matter. Writers and
+        invalidations must both use this.
+        """
+        return cls.make_key(" ".join(question.lower().split()))
+
+    # --- Key/value ---
+
+    def get(self, namespace: str, key: str):
+        """Returns the cached value, or None on a miss. Records hit/miss counters."""
+        if not self.enabled:
+            return None
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"--- Cache: Read error ({namespace}): {e} ---")
+            return None
+
+        hit = row is not None and row[1] >= time.time()
+        self.incr(f"cache.{namespace}.{'hit' if hit else 'miss'}")
+        return json.loads(row[0]) if hit else None
+
+    def set(self, namespace: str, key: str, value, ttl: int | None = None):
+        if not self.enabled:
+            return
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+        except sqlite3.Error as e:
+            print(f"--- Cache: Write error ({namespace}): {e} ---")
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            print(f"--- Cache: Delete error ({namespace}): {e} ---")
+
+    def purge_expired(self) -> int:
+        try:
+            return self._conn().execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),)).rowcount
+        except sqlite3.Error as e:
+            print(f"--- Cache: Purge error: {e} ---")
+            return 0
+
+    def maybe_purge(self, interval: float = SHARED_CACHE_PURGE_INTERVAL) -> int:
+        """purge_expired(), if this process hasn't run it in the last `interval` seconds."""
+        now = time.monotonic()
+        if now - self._last_purge < interval:
+            return 0
+        self._last_purge = now
+        purged = self.purge_expired()
+        if purged:
+            print(f"--- Cache: Purged {purged} expired entries ---")
+        return purged
+
+    # --- Counters ---
+
+    def incr(self, name: str, amount: float = 1):
+        """Buffered; visible to other workers after the next flush_counters()."""
+        with self._pending_lock:
+            self._pending[name] += amount
+
+    def flush_counters(self):
+        """Writes the buffered counter increments in a single transaction."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(pending.items())
+                )
+        except sqlite3.Error as e:
+            print(f"--- Cache: Counter flush error: {e} ---")
+
+    def observe(self, name: str, seconds: float):
+        """Records one timing sample as `<name>.count` / `<name>.total_seconds`."""
+        self.incr(f"{name}.count")
+        self.incr(f"{name}.total_seconds", seconds)
+
+    def counters(self, prefix: str = "") -> dict:
+        self.flush_counters()  # include this worker's buffered counts
+        try:
+            rows = self._conn().execute(
+                "SELECT name, value FROM counters WHERE name LIKE ? ORDER BY name",
+                (prefix + "%",)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"--- Cache: Counter read error: {e} ---")
+            return {}
+        return {name: value for name, value in rows}
+
+    def hit_rates(self) -> dict:
+        """{namespace: {"hits", "misses", "hit_rate"}} across all workers."""
+        rates = {}
+        for name, value in self.counters("cache.").items():
+            _, namespace, outcome = name.rsplit(".", 2)
+            entry = rates.setdefault(namespace, {"hits": 0, "misses": 0, "hit_rate": 0.0})
+            entry["hits" if outcome == "hit" else "misses"] += int(value)
+        for entry in rates.values():
+            total = entry["hits"] + entry["misses"]
+            entry["hit_rate"] = entry["hits"] / total if total else 0.0
+        return rates
+
+    # --- Worker stats ---
+
+    def report_worker(self, stats: dict):
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO workers (pid, stats, updated_at) VALUES (?, ?, ?)",
+                (stats["pid"], json.dumps(stats), time.time())
+            )
+        except sqlite3.Error as e:
+            print(f"--- Cache: Worker stats error: {e} ---")
+
+    def workers(self, max_age: float = 300) -> list:
+        """Stats reported by workers in the last `max_age` seconds."""
+        try:
+            rows = self._conn().execute(
+                "SELECT stats, updated_at FROM workers WHERE updated_at >= ? ORDER BY pid",
+                (time.time() - max_age,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"--- Cache: Worker stats read error: {e} ---")
+            return []
+        return [dict(json.loads(stats), updated_at=updated_at) for stats, updated_at in rows]
+
+shared_cache = SharedCache()
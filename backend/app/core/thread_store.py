@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# --- Server-side thread store ---
+# Keeps what /ask produced for each thread_id (question, retrieved context,
+# source, solution) so /feedback only needs the thread_id and the feedback,
+# and refinement can reuse the same context instead of refining blind.
+#
+# In memory it is an LRU bounded by entry count *and* approximate size,
+# with a TTL. Optionally every entry is also written to a persistent
+# backend (the node-wide SQLite cache), so a /feedback call that lands on
+# a different worker, or after a restart, still finds its thread. With a
+# backend, reads go to it first so every worker sees the latest turn; the
+# local copy is only a fallback when the backend can't answer.
+
+THREAD_STORE_TTL = int(os.environ.get("THREAD_STORE_TTL", "86400"))  # 1 day
+THREAD_STORE_MAX_ENTRIES = int(os.environ.get("THREAD_STORE_MAX_ENTRIES", "10000"))
+THREAD_STORE_MAX_BYTES = int(os.environ.get("THREAD_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+THREAD_STORE_PERSIST = os.environ.get("THREAD_STORE_PERSIST", "1") != "0"
+
+def _approx_size(record: dict) -> int:
+    return sum(len(k) + len(v) if isinstance(v, str) else len(k) + 16 for k, v in record.items())
+
+class ThreadStore:
+    def __init__(self, ttl: int = THREAD_STORE_TTL, max_entries: int = THREAD_STORE_MAX_ENTRIES,
+                 max_bytes: int = THREAD_STORE_MAX_BYTES, backend=None, namespace: str = "threads"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend  # anything with get/set/delete(namespace, key, ...)
+        self.namespace = namespace
+        self._entries = OrderedDict()  # thread_id -> (record, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _drop(self, thread_id: str):
+        _, size, _ = self._entries.pop(thread_id)
+        self._bytes -= size
+
+    def _evict(self):
+        now = time.time()
+        for thread_id in [t for t, (_, _, expires_at) in self._entries.items() if expires_at < now]:
+            self._drop(thread_id)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remember(self, thread_id: str, record: dict):
+        size = _approx_size(record)
+        with self._lock:
+            if thread_id in self._entries:
+                self._drop(thread_id)
+            self._entries[thread_id] = (record, size, time.time() + self.ttl)
+            self._bytes += size
+            self._evict()
+
+    def _local(self, thread_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                return None
+            if entry[2] < time.time():
+                self._drop(thread_id)
+                return None
+            self._entries.move_to_end(thread_id)
+            return entry[0]
+
+    def put(self, thread_id: str, record: dict):
+        self._remember(thread_id, record)
+        if self.backend is not None:
+            self.backend.set(self.namespace, thread_id, record, ttl=self.ttl)
+
+    def get(self, thread_id: str) -> dict | None:
+        if self.backend is None:
+            return self._local(thread_id)
+        # The backend is the source of truth: another worker may have
+        # rewritten the thread (e.g. after a refinement) since we cached it.
+        record = self.backend.get(self.namespace, thread_id)
+        if record is not None:
+            self._remember(thread_id, record)
+            return record
+        # Miss or backend error: this worker's copy is the best we have.
+        return self._local(thread_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "approx_bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "persistent": self.backend is not None,
+            }
+
+def _make_thread_store() -> ThreadStore:
+    if not THREAD_STORE_PERSIST:
+        return ThreadStore()
+    from app.core.shared_cache import SharedCache, SHARED_CACHE_PATH
+    # Its own handle, so SHARED_CACHE_ENABLED=0 (benchmarks) doesn't lose threads.
+    return ThreadStore(backend=SharedCache(SHARED_CACHE_PATH, enabled=True))
+
+thread_store = _make_thread_store()
@@ -2,18 +2,31 @@
 import os
 import json
 import uuid
+import time
+import hmac
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict, Any
 
 # Import our modular services
 # make sure the path is correct
 from app.services.guardrails import check_input_guardrail, check_output_guardrail
-from app.services.rag_pipeline import generate_solution
-from app.services.dspy_feedback import refine_solution_with_dspy
+from app.services.rag_pipeline import run_pipeline, answer_source_history, kb_hash_index
+from app.services.dspy_feedback import refine_solution_with_dspy, refiner_registry
+from app.services.cascade import cascade_stats
+from app.services.kb_learning import kb_learner
+from app.core.shared_cache import shared_cache
+from app.core.procstats import memory_stats, memory_breakdown
+from app.core.profiling import (
+    ADMIN_TOKEN, TRACEMALLOC_REQUESTS, PROFILE_SAMPLE_INTERVAL, sample_stacks, ProfilerBusy,
+    allocation_tracker
+)
+from app.core.clients import embedding_cache
+from app.core.thread_store import thread_store
 from app.schemas import (
-    AskRequest, AskResponse, FeedbackRequest, FeedbackResponse
+    AskRequest, AskResponse, FeedbackRequest, FeedbackResponse, RefinerVersionResponse
 )
 
 # Initialize FastAPI
@@ -28,13 +41,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Worker stats ---
+# Each worker publishes its memory usage to the shared cache (at most every
+# WORKER_STATS_INTERVAL seconds) so /stats can show every worker on the node.
+WORKER_STATS_INTERVAL = float(os.getenv("WORKER_STATS_INTERVAL", "15"))
+_last_worker_report = 0.0
+
+def report_worker_stats():
+    global _last_worker_report
+    _last_worker_report = time.monotonic()
+    shared_cache.flush_counters()
+    shared_cache.maybe_purge()
+    shared_cache.report_worker(memory_stats())
+
+# Plain ASGI middlewares: unlike @app.middleware("http") they add no
+# per-request task or body streaming, so they cost nothing when idle.
+
+class WorkerStatsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and time.monotonic() - _last_worker_report >= WORKER_STATS_INTERVAL:
+            report_worker_stats()
+
+class AllocationTrackingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Off unless TRACEMALLOC_REQUESTS=1 or POST /admin/tracemalloc turned it on.
+        if scope["type"] != "http" or not allocation_tracker.enabled:
+            await self.app(scope, receive, send)
+            return
+        before = allocation_tracker.snapshot()
+        await self.app(scope, receive, send)
+        allocation_tracker.record(f"{scope['method']} {scope['path']}", before)
+
+app.add_middleware(WorkerStatsMiddleware)
+# Tracking can only ever be on with TRACEMALLOC_REQUESTS=1 or via the admin endpoint.
+if TRACEMALLOC_REQUESTS or ADMIN_TOKEN:
+    app.add_middleware(AllocationTrackingMiddleware)
+
+# --- Admin auth ---
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    """Admin endpoints need `X-Admin-Token: $ADMIN_TOKEN`; without ADMIN_TOKEN they don't exist."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+# --- Lifecycle ---
+
+@app.on_event("startup")
+def start_background_tasks():
+    # Started here (not at import) so every worker process gets its own watcher.
+    refiner_registry.start_watcher()
+    kb_learner.start_worker()
+    kb_hash_index.warm()
+    report_worker_stats()
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    refiner_registry.stop_watcher()
+    kb_learner.stop_worker()
+    shared_cache.flush_counters()
+
 # --- API Endpoints ---
 
 @app.post("/ask/", response_model=AskResponse)
 async def ask_math_question(request: AskRequest):
     """
     Endpoint to ask the Math Agent a question.
-    This is a stateless request-response.
+    The turn (question, context, source, solution) is kept in the thread
+    store so /feedback only needs the thread_id.
     """
     # 1. Input Guardrail
     is_safe, reason = check_input_guardrail(request.question)
@@ -43,9 +125,9 @@ async def ask_math_question(request: AskRequest):
     
     # 2. RAG + MCP Pipeline
     try:
-        solution, source = await generate_solution(request.question)
+        solution, source, context = await run_pipeline(request.question)
     except Exception as e:
-        print(f"--- Main Error (generate_solution): {e} ---")
+        print(f"--- Main Error (run_pipeline): {e} ---")
         raise HTTPException(status_code=500, detail="Agent failed to process.")
     
     # 3. Output Guardrail (Fast, non-LLM)
@@ -53,11 +135,18 @@ async def ask_math_question(request: AskRequest):
     if not is_safe:
         raise HTTPException(status_code=500, detail=f"Output blocked: {message}")
     
-    # 4. Return the final response
+    # 4. Remember the turn, then return the final response
+    thread_id = str(uuid.uuid4()) # New ID for this "turn"
+    thread_store.put(thread_id, {
+        "question": request.question,
+        "context": context,
+        "source": source,
+        "solution": message,
+    })
     return AskResponse(
         solution=message,
         source=source,
-        thread_id=str(uuid.uuid4()), # New ID for this "turn"
+        thread_id=thread_id,
         question=request.question
     )
 
@@ -67,10 +156,29 @@ async def give_feedback(request: FeedbackRequest):
     Endpoint to receive feedback and (if "bad") get a refinement.
     """
     print(f"--- HITL: Received Feedback for {request.thread_id} ---")
+
+    # 0. Look the turn up. The stored turn always wins; question/solution sent
+    #    by the client are only used for threads the server doesn't know
+    #    (older clients, expired threads).
+    thread = thread_store.get(request.thread_id)
+    if thread is not None:
+        question = thread.get("question")
+        original_solution = thread.get("solution")
+        context = thread.get("context")
+    else:
+        question = request.question
+        original_solution = request.original_solution
+        context = None
+    if not question or not original_solution:
+        raise HTTPException(
+            status_code=404,
+            detail="Unknown or expired thread_id. Please ask the question again."
+        )
     
     # 1. Log the feedback (for DSPy offline optimization)
     try:
         feedback_entry = request.model_dump()
+        feedback_entry.update(question=question, original_solution=original_solution, context=context)
         feedback_entry["timestamp"] = datetime.utcnow().isoformat()
         
         # We assume the backend is running in the 'backend' folder
@@ -82,41 +190,159 @@ async def give_feedback(request: FeedbackRequest):
 
     # 2. If feedback is "bad", generate a refinement
     if request.rating == "bad" and request.feedback_text:
+        # Don't keep serving an answer the student rejected.
+        shared_cache.delete("answers", shared_cache.question_key(question))
         print(f"--- HITL: Rating is 'bad'. Generating refinement... ---")
         try:
             # 3. Run DSPy Refinement
+            # (reusing the context the first answer was built from)
             refined_solution = refine_solution_with_dspy(
-                question=request.question,
-                original_solution=request.original_solution,
-                user_feedback=request.feedback_text
+                question=question,
+                original_solution=original_solution,
+                user_feedback=request.feedback_text,
+                context=context
             )
+            if refined_solution is None:
+                raise HTTPException(status_code=503, detail="Could not refine the solution right now. Please try again.")
             
             # 4. Output Guardrail (on the new solution)
             is_safe, message = check_output_guardrail(refined_solution)
             if not is_safe:
                 raise HTTPException(status_code=500, detail=f"Refined output blocked: {message}")
 
-            # 5. Return new, refined solution
+            # 5. The refined answer is now the thread's answer; learn it and return it
+            if thread is not None:
+                # Only turns the server produced are learned or stored, never
+                # client-supplied text.
+                kb_learner.enqueue(question, message, "refined")
+                thread_store.put(request.thread_id, {
+                    "question": question,
+                    "context": context,
+                    "source": "refined",
+                    "solution": message,
+                })
             return FeedbackResponse(
                 solution=message,
                 source="refined", # New source
                 thread_id=request.thread_id,
-                question=request.question
+                question=question
             )
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"--- HITL: Error during refinement: {e} ---")
             raise HTTPException(status_code=500, detail="Error processing feedback.")
     
-    # If rating is "good", just log it and return a different response.
+    # If rating is "good", log it, queue the answer for the KB and return a different response.
     # We must return a FeedbackResponse, so we just return the original info.
-    print("--- HITL: Rating is 'good'. Logging only. ---")
+    if request.rating == "good" and thread is not None:
+        print("--- HITL: Rating is 'good'. Queued for the knowledge base. ---")
+        kb_learner.enqueue(thread["question"], thread["solution"], thread.get("source", "feedback"))
+    elif request.rating == "good":
+        print("--- HITL: Rating is 'good' for an unknown thread. Logging only. ---")
+    else:
+        print("--- HITL: No feedback text. Logging only. ---")
     return FeedbackResponse(
-        solution=request.original_solution,
+        solution=original_solution,
         source="feedback_logged",
         thread_id=request.thread_id,
-        question=request.question
+        question=question
     )
 
+@app.get("/refiner/version", response_model=RefinerVersionResponse)
+def get_refiner_version():
+    """
+    Returns the currently loaded (and previous) refiner module version.
+    """
+    return RefinerVersionResponse(**refiner_registry.info())
+
+@app.post("/refiner/reload", response_model=RefinerVersionResponse, dependencies=[Depends(require_admin)])
+def reload_refiner():
+    """
+    Clears any rollback pin and forces a reload of the refiner module from disk.
+    """
+    refiner_registry.reload(force=True)
+    return RefinerVersionResponse(**refiner_registry.info())
+
+@app.post("/refiner/rollback", response_model=RefinerVersionResponse, dependencies=[Depends(require_admin)])
+def rollback_refiner():
+    """
+    Swaps back to the previously loaded refiner module and pins it
+    (for every worker, across restarts) until the next /refiner/reload.
+    """
+    if not refiner_registry.rollback():
+        raise HTTPException(status_code=409, detail="No previous refiner version to roll back to.")
+    return RefinerVersionResponse(**refiner_registry.info())
+
+@app.get("/stats")
+def get_stats():
+    """
+    Node-wide stats: memory per worker, cache hit rates and counters
+    (aggregated across every worker sharing the cache file).
+    """
+    report_worker_stats()
+    answer_sources = {
+        name.rsplit(".", 1)[1]: count
+        for name, count in shared_cache.counters("answers.source.").items()
+    }
+    total_answers = sum(answer_sources.values())
+    return {
+        "workers": shared_cache.workers(),
+        "cache_hit_rates": shared_cache.hit_rates(),
+        # Share of /ask traffic served by each path (e.g. knowledge_base_exact).
+        "answer_source_shares": {
+            source: count / total_answers for source, count in answer_sources.items()
+        } if total_answers else {},
+        "cascade": cascade_stats(),
+        # Per worker (this one): the embedding cache keeps its counters in-process.
+        "embedding_cache": embedding_cache.stats(),
+        "thread_store": thread_store.stats(),
+        "kb_learning": kb_learner.stats(),
+        "kb_hash_index": kb_hash_index.stats(),  # this worker only
+        # Daily KB-hit / web-fallback rates, to see the KB absorb web traffic.
+        "answer_source_history": answer_source_history(),
+        "counters": shared_cache.counters(),
+    }
+
+# --- Admin: profiling ---
+
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def profile_worker(seconds: float = 10, interval: float = PROFILE_SAMPLE_INTERVAL):
+    """
+    Samples this worker's threads for `seconds` and returns collapsed stacks
+    (feed them to flamegraph.pl or speedscope). A sync endpoint, so the
+    sampling runs in the threadpool and the event loop keeps serving.
+    """
+    try:
+        profile = sample_stacks(seconds, interval)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker.")
+    return PlainTextResponse(profile["collapsed"], headers={
+        "X-Worker-Pid": str(os.getpid()),
+        "X-Profile-Samples": str(profile["samples"]),
+    })
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+def worker_memory():
+    """
+    This worker's memory, the startup breakdown per client, and the
+    per-request allocation reports (when tracking is on).
+    """
+    return {
+        "process": memory_stats(),
+        "startup_breakdown": memory_breakdown(),
+        "allocations": allocation_tracker.stats(),
+    }
+
+@app.post("/admin/tracemalloc", dependencies=[Depends(require_admin)])
+def toggle_allocation_tracking(enabled: bool):
+    """Turns per-request allocation tracking on or off for this worker."""
+    if enabled:
+        allocation_tracker.start()
+    else:
+        allocation_tracker.stop()
+    return {"pid": os.getpid(), "enabled": allocation_tracker.enabled}
+
 @app.get("/")
 def read_root():
     return {"Hello": "Math Agent API is running (Stateless HITL Version)."}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal
+from typing import Literal, Optional
 
 # --- /ask endpoint ---
 class AskRequest(BaseModel):
@@ -14,11 +14,12 @@ class AskResponse(BaseModel):
 
 # --- /feedback endpoint ---
 class FeedbackRequest(BaseModel):
-    question: str
-    original_solution: str
-    feedback_text: str
-    rating: Literal["good", "bad"]
     thread_id: str
+    rating: Literal["good", "bad"]
+    feedback_text: str = ""
+    # Optional: the server keeps both per thread_id (see app.core.thread_store).
+    question: Optional[str] = None
+    original_solution: Optional[str] = None
 
 class FeedbackResponse(BaseModel):
     solution: str
@@ -26,3 +27,14 @@ class FeedbackResponse(BaseModel):
     thread_id: str
     question: str
 
+
+# --- /refiner endpoints ---
+class RefinerVersion(BaseModel):
+    version: str
+    path: Optional[str] = None
+    loaded_at: str
+
+class RefinerVersionResponse(BaseModel):
+    current: RefinerVersion
+    previous: Optional[RefinerVersion] = None
+    pinned: Optional[str] = None # Set by a rollback until the next forced reload
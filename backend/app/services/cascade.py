@@ -0,0 +1,226 @@
+import re
+import ast
+import time
+import operator
+from typing import NamedTuple, Any
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from app.core.shared_cache import shared_cache
+from app.services.guardrails import check_output_guardrail
+
+# --- Model cascade ---
+# Cheap tiers try first, and an answer only escalates to the next (stronger)
+# tier when it fails a cheap self-check. Tiers are plain LangChain chat
+# models, so the cascade can be exercised with local stand-ins, e.g.
+#
+#   from langchain_core.language_models import FakeListChatModel
+#   tiers = [Tier("lite", FakeListChatModel(responses=["I'm sorry"])),
+#            Tier("strong", FakeListChatModel(responses=["... Final answer: 4"]))]
+#   solution, tier = await run_cascade(prompt, inputs, tiers)
+#
+# Decisions and per-tier latency are recorded as shared counters (/stats).
+
+LOCAL_SOLVER_SOURCE = "local_solver"
+
+class Tier(NamedTuple):
+    name: str
+    llm: Any
+
+class CascadeExhausted(Exception):
+    """
+    Every tier failed the self-check (the last tier's answer is attached).
+    `raised` is True when the last tier errored instead of answering
+    (e.g. the API is down), so callers can report an error, not an answer.
+    """
+    def __init__(self, solution: str | None, reason: str, raised: bool = False):
+        super().__init__(reason)
+        self.solution = solution
+        self.raised = raised
+
+# --- 1. Local arithmetic solver (tier 0) ---
+
+_BIN_OPS = {
+    ast.Add: (operator.add, "+"),
+    ast.Sub: (operator.sub, "-"),
+    ast.Mult: (operator.mul, "×"),
+    ast.Div: (operator.truediv, "÷"),
+    ast.Mod: (operator.mod, "mod"),
+    ast.Pow: (operator.pow, "^"),
+}
+_UNARY_OPS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+_QUESTION_PREFIX = re.compile(r"^\s*(what\s+is|what's|calculate|compute|evaluate|find|solve)\s*:?\s*", re.IGNORECASE)
+_QUESTION_SUFFIX = re.compile(r"\s*(=\s*\?*|\?)+\s*$")
+_EXPRESSION = re.compile(r"^[\d\s.+\-*/%^()]+$")
+
+def _format_number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, float):
+        return f"{value:.10g}"
+    return str(value)
+
+def _evaluate(node, steps: list):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_evaluate(node.operand, steps))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        left = _evaluate(node.left, steps)
+        right = _evaluate(node.right, steps)
+        fn, symbol = _BIN_OPS[type(node.op)]
+        if isinstance(node.op, ast.Pow) and (abs(right) > 64 or abs(left) > 10**6):
+            raise ValueError("exponent too large for the local solver")
+        result = fn(left, right)
+        steps.append(f"{_format_number(left)} {symbol} {_format_number(right)} = {_format_number(result)}")
+        return result
+    raise ValueError("unsupported expression")
+
+def extract_expression(question: str) -> str | None:
+    """Returns the arithmetic expression if the question is nothing but one."""
+    text = _QUESTION_PREFIX.sub("", question.strip())
+    text = _QUESTION_SUFFIX.sub("", text)
+    text = text.replace("×", "*").replace("÷", "/").replace("·", "*")
+    if not text or not _EXPRESSION.match(text) or not re.search(r"\d\s*[-+*/%^]", text):
+        return None
+    return text.replace("^", "**")
+
+def solve_arithmetic(question: str) -> str | None:
+    """
+    Solves pure arithmetic questions ("5+5-19*5 =?") locally, showing each
+    operation in order-of-operations order. Returns None for anything else.
+    """
+    expression = extract_expression(question)
+    if expression is None:
+        return None
+    try:
+        steps = []
+        result = _evaluate(ast.parse(expression, mode="eval").body, steps)
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError):
+        return None
+
+    lines = [
+        f"Let's evaluate **{expression.replace('**', '^')}** step by step, following the order of operations "
+        "(brackets, exponents, multiplication/division, then addition/subtraction).",
+        "",
+    ]
+    lines += [f"{i}. {step}" for i, step in enumerate(steps, start=1)]
+    lines += ["", f"**Final Answer:** {_format_number(result)}"]
+    return "\n".join(lines)
+
+# --- 2. Self-check ---
+
+_FINAL_ANSWER = re.compile(r"final answer\s*(?:is)?[\s:*]*(.+)", re.IGNORECASE)
+_BOXED = re.compile(r"\\boxed\{(.+?)\}")
+_HEDGES = re.compile(r"cannot|can't|unknown|not (?:enough|possible|determin)|unclear|\?\s*$", re.IGNORECASE)
+# "48 / 2 = 24" style steps. Only plain numbers ("1,200" and a leading
+# unary minus included) and operators on the left; the step must not
+# start in the middle of a number or a longer expression.
+_OPERAND = r"(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?"
+_ARITHMETIC_STEP = re.compile(
+    rf"(?<![\w.^,\-])(-?(?:{_OPERAND}\s*[-+*/×÷]\s*)+{_OPERAND})\s*=\s*(-?\d[\d,]*(?:\.\d+)?)"
+    r"(?![\d.]*\s*[-+*/×÷^]\s*\d)"
+)
+
+def final_answer(solution: str) -> str | None:
+    """The text of the last "Final Answer: ..." line (or \\boxed{...})."""
+    matches = _FINAL_ANSWER.findall(solution) or _BOXED.findall(solution)
+    if not matches:
+        return None
+    answer = matches[-1].strip().strip("*").strip()
+    return answer or None
+
+def arithmetic_mistake(solution: str) -> str | None:
+    """Re-computes simple "a op b = c" steps; returns the first wrong one."""
+    for left, right in _ARITHMETIC_STEP.findall(solution):
+        expression = left.replace(",", "").replace("×", "*").replace("÷", "/")
+        try:
+            value = _evaluate(ast.parse(expression, mode="eval").body, [])
+            stated = float(right.replace(",", ""))
+        except (SyntaxError, ValueError, ZeroDivisionError, OverflowError):
+            continue
+        # Stated results are often rounded ("10 / 3 = 3.33").
+        decimals = len(right.split(".")[1]) if "." in right else 0
+        if abs(value - stated) > max(0.5 * 10 ** -decimals, 1e-9 * abs(value)):
+            return f"{left.strip()} = {right}"
+    return None
+
+def self_check(solution: str | None) -> tuple[bool, str]:
+    """
+    Cheap check run on every tier's answer: it must pass the output
+    guardrail, end with a definite final answer, and every plain
+    "a op b = c" step in it must be arithmetically right.
+    """
+    is_safe, message = check_output_guardrail(solution)
+    if not is_safe:
+        return False, message
+    answer = final_answer(solution)
+    if answer is None:
+        return False, "No final answer line."
+    if _HEDGES.search(answer):
+        return False, f"Final answer is not definite: {answer[:80]}"
+    mistake = arithmetic_mistake(solution)
+    if mistake:
+        return False, f"Arithmetic mistake: {mistake}"
+    return True, "OK"
+
+# --- 3. Cascade ---
+
+async def run_cascade(prompt: ChatPromptTemplate, inputs: dict, tiers: list[Tier]) -> tuple[str, str]:
+    """
+    Runs `prompt | tier.llm` for each tier in order until one answer passes
+    the self-check. Returns (solution, tier_name).
+    Raises CascadeExhausted if no tier produced an acceptable answer.
+    """
+    shared_cache.incr("cascade.requests")
+    solution, reason, raised = None, "No tiers configured.", False
+    for index, tier in enumerate(tiers):
+        chain = prompt | tier.llm | StrOutputParser()
+        start = time.perf_counter()
+        try:
+            solution = await chain.ainvoke(inputs)
+            ok, reason = self_check(solution)
+            raised = False
+        except Exception as e:
+            ok, reason, raised = False, f"{type(e).__name__}: {e}", True
+        shared_cache.observe(f"cascade.tier.{tier.name}", time.perf_counter() - start)
+
+        if ok:
+            print(f"--- Cascade: Served by tier '{tier.name}' ---")
+            shared_cache.incr(f"cascade.served.{tier.name}")
+            return solution, tier.name
+
+        if index + 1 < len(tiers):
+            print(f"--- Cascade: Tier '{tier.name}' failed self-check ({reason}). Escalating. ---")
+            shared_cache.incr(f"cascade.escalated.{tier.name}")
+
+    shared_cache.incr("cascade.exhausted")
+    raise CascadeExhausted(None if raised else solution, reason, raised)
+
+def record_local_solver(seconds: float):
+    shared_cache.incr("cascade.requests")
+    shared_cache.observe(f"cascade.tier.{LOCAL_SOLVER_SOURCE}", seconds)
+    shared_cache.incr(f"cascade.served.{LOCAL_SOLVER_SOURCE}")
+
+def cascade_stats() -> dict:
+    """Escalation rate and average latency per tier, across all workers."""
+    counters = shared_cache.counters("cascade.")
+    requests = counters.get("cascade.requests", 0)
+    escalations = sum(v for k, v in counters.items() if k.startswith("cascade.escalated."))
+    tiers = {}
+    for name, value in counters.items():
+        if name.startswith("cascade.tier.") and name.endswith(".count"):
+            tier = name[len("cascade.tier."):-len(".count")]
+            total = counters.get(f"cascade.tier.{tier}.total_seconds", 0.0)
+            tiers[tier] = {
+                "calls": int(value),
+                "avg_latency_seconds": total / value if value else 0.0,
+                "served": int(counters.get(f"cascade.served.{tier}", 0)),
+                "escalated": int(counters.get(f"cascade.escalated.{tier}", 0)),
+            }
+    return {
+        "requests": int(requests),
+        "escalation_rate": escalations / requests if requests else 0.0,
+        "exhausted": int(counters.get("cascade.exhausted", 0)),
+        "tiers": tiers,
+    }
@@ -1,3 +1,8 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
 import dspy
 from app.core.clients import dspy_gemini_lm # Use shared DSPy client
 
@@ -14,6 +19,7 @@ class RefineSolutionSignature(dspy.Signature):
     question = dspy.InputField(desc="The original math question.")
     original_solution = dspy.InputField(desc="Your first, incorrect/insufficient solution.")
     user_feedback = dspy.InputField(desc="The student's feedback or correction.")
+    context = dspy.InputField(desc="The reference material (similar KB problem or web results) the first solution was based on. May be empty.")
     
     refined_solution = dspy.OutputField(
         desc="Your new, refined step-by-step solution."
@@ -26,44 +32,269 @@ class RefinementModule(dspy.Module):
         super().__init__()
         self.refiner = dspy.ChainOfThought(RefineSolutionSignature)
 
-    def forward(self, question, original_solution, user_feedback):
+    def forward(self, question, original_solution, user_feedback, context=""):
         result = self.refiner(
             question=question,
             original_solution=original_solution,
-            user_feedback=user_feedback
+            user_feedback=user_feedback,
+            context=context or ""
         )
         return dspy.Prediction(refined_solution=result.refined_solution)
 
-# --- 3. Create the function our API will call ---
-# initialize the module here.
-dspy_refiner = RefinementModule()
+def signature_mismatch(state: dict) -> str | None:
+    """
+    Saved modules store field prefixes/descriptions by *position*, and DSPy
+    zips them onto the current signature's fields on load. A file saved
+    for an older signature (e.g. before `context` was added) would shift
+    every description by one, so it must be rejected, not loaded.
+    Returns why `state` doesn't fit RefineSolutionSignature, or None.
+    """
+    for name, expected in RefinementModule().dump_state().items():
+        if "signature" not in expected:
+            continue
+        saved = state.get(name)
+        if saved is None:
+            return f"no saved state for '{name}'"
+        want = [field["prefix"] for field in expected["signature"]["fields"]]
+        got = [field.get("prefix") for field in saved.get("signature", {}).get("fields", [])]
+        if got != want:
+            return f"'{name}' was saved with fields {got}, the signature has {want}"
+    return None
+
+# --- 3. Hot-reloadable module registry ---
+# The optimizer (scripts/optimize.py) rewrites the JSON file; a background
+# thread notices, builds and validates a fresh module, then swaps it in.
+# Requests already running keep the module object they started with.
+#
+# Every module that loads is also archived by version, and a rollback
+# writes a pin file into the archive directory. Every worker's watcher (and every
+# restart) honours the pin, loading the pinned version from the archive,
+# until a forced reload clears it.
+DEFAULT_MODULE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'optimized_refiner_module.json')
+REFINER_MODULE_PATH = os.path.abspath(os.environ.get("REFINER_MODULE_PATH", DEFAULT_MODULE_PATH))
+REFINER_RELOAD_INTERVAL = float(os.environ.get("REFINER_RELOAD_INTERVAL", "10"))
+# Archive of loaded versions; must be writable for rollbacks to survive restarts.
+REFINER_ARCHIVE_DIR = os.path.abspath(os.environ.get(
+    "REFINER_ARCHIVE_DIR", os.path.splitext(REFINER_MODULE_PATH)[0] + "_versions"
+))
+DEFAULT_VERSION = "default"  # the un-optimized module, no file
+
+class RefinerRegistry:
+    def __init__(self, path: str, archive_dir: str = REFINER_ARCHIVE_DIR):
+        self.path = path
+        self.archive_dir = archive_dir
+        self.pin_path = os.path.join(archive_dir, "pinned.json")
+        self._lock = threading.Lock()
+        self._current = (RefinementModule(), self._version_info(DEFAULT_VERSION, None))
+        self._previous = None
+        self._last_signature = None
+        self._from_pin = False  # current module was loaded because of a pin
+        self._watcher = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _version_info(version: str, path: str | None) -> dict:
+        return {"version": version, "path": path, "loaded_at": datetime.utcnow().isoformat()}
+
+    @property
+    def module(self) -> RefinementModule:
+        return self._current[0]
+
+    def info(self) -> dict:
+        current, previous = self._current, self._previous
+        return {
+            "current": current[1],
+            "previous": previous[1] if previous else None,
+            "pinned": self.pinned_version(),
+        }
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _archive(self, version: str, raw: bytes):
+        """Best-effort: an unwritable archive only means pins can't be restored."""
+        archived = os.path.join(self.archive_dir, f"{version}.json")
+        if os.path.exists(archived):
+            return
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            tmp_path = f"{archived}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, archived)
+        except OSError as e:
+            print(f"--- DSPy: Could not archive refiner module {version} ({e}). ---")
+
+    def _build(self, path: str) -> tuple:
+        """Builds and validates a new module from disk. Raises on failure."""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        version = hashlib.sha256(raw).hexdigest()[:12]
+        mismatch = signature_mismatch(json.loads(raw))
+        if mismatch:
+            raise ValueError(f"module doesn't match the signature: {mismatch}")
+        module = RefinementModule()
+        module.load(path)
+        # Validation: the file must have loaded into our predictor and every
+        # demo must carry the fields the signature needs.
+        predictors = dict(module.named_predictors())
+        if not predictors:
+            raise ValueError("module has no predictors")
+        for name, predictor in predictors.items():
+            for demo in predictor.demos:
+                missing = [k for k in ("question", "refined_solution") if k not in demo]
+                if missing:
+                    raise ValueError(f"demo in '{name}' is missing {missing}")
+        self._archive(version, raw)
+        return module, self._version_info(version, path)
+
+    # --- Pinning (persistent rollback) ---
+
+    def pinned_version(self) -> str | None:
+        try:
+            with open(self.pin_path, 'r') as f:
+                return json.load(f).get("version")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_pin(self, version: str | None):
+        try:
+            if version is None:
+                if os.path.exists(self.pin_path):
+                    os.remove(self.pin_path)
+                return
+            tmp_path = f"{self.pin_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": version, "pinned_at": datetime.utcnow().isoformat()}, f)
+            os.replace(tmp_path, self.pin_path)
+        except OSError as e:
+            print(f"--- DSPy: Could not update the refiner pin ({e}). This worker only. ---")
+
+    def _swap(self, candidate: tuple) -> bool:
+        with self._lock:
+            if candidate[1]["version"] == self._current[1]["version"]:
+                return False
+            self._previous, self._current = self._current, candidate
+        return True
+
+    def _load_pinned(self, version: str) -> bool:
+        """Makes the pinned version current (from the archive). Returns True if swapped."""
+        if version == self._current[1]["version"]:
+            self._from_pin = True
+            return False
+        try:
+            if version == DEFAULT_VERSION:
+                candidate = (RefinementModule(), self._version_info(DEFAULT_VERSION, None))
+            else:
+                candidate = self._build(os.path.join(self.archive_dir, f"{version}.json"))
+        except Exception as e:
+            print(f"--- DSPy: Can't load pinned refiner module {version} ({e}). Keeping {self._current[1]['version']}. ---")
+            return False
+        self._from_pin = True
+        if self._swap(candidate):
+            print(f"--- DSPy: Loaded pinned refiner module {version}. ---")
+            return True
+        return False
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Reloads the module if the file changed (or switches to the pinned
+        version, if one is pinned). A forced reload clears the pin first.
+        Returns True if swapped.
+        """
+        if force:
+            self._write_pin(None)
+        pinned = self.pinned_version()
+        if pinned is not None:
+            return self._load_pinned(pinned)
+        if self._from_pin:
+            # Un-pinned (possibly by another worker): go back to the file
+            # even though it hasn't changed.
+            self._from_pin = False
+            self._last_signature = None
+
+        signature = self._file_signature()
+        if signature is None:
+            return False
+        if not force and signature == self._last_signature:
+            return False
+        self._last_signature = signature
+        try:
+            candidate = self._build(self.path)
+        except Exception as e:
+            print(f"--- DSPy: Rejected new refiner module ({e}). Keeping {self._current[1]['version']}. ---")
+            return False
+        if not self._swap(candidate):
+            return False
+        print(f"--- DSPy: Loaded optimized refinement module {candidate[1]['version']}! ---")
+        return True
+
+    def rollback(self) -> bool:
+        """
+        Swaps back to the previously loaded module and pins it, so every
+        worker and every restart uses it too. Returns False if there is none.
+        """
+        with self._lock:
+            if self._previous is None:
+                return False
+            self._current, self._previous = self._previous, self._current
+            version = self._current[1]["version"]
+        self._write_pin(version)
+        self._from_pin = True
+        print(f"--- DSPy: Rolled back to (and pinned) refiner module {version}. ---")
+        return True
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            self.reload()
+
+    def start_watcher(self, interval: float = REFINER_RELOAD_INTERVAL):
+        """Starts the background file watcher (once per process)."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True, name="refiner-watcher")
+        self._watcher.start()
+        print(f"--- DSPy: Watching {self.path} every {interval}s. ---")
+
+    def stop_watcher(self):
+        self._stop.set()
+
+refiner_registry = RefinerRegistry(REFINER_MODULE_PATH)
 
-try:
-    dspy_refiner.load("backend/optimized_refiner_module.json")
-    print("--- DSPy: Loaded optimized refinement module! ---")
-except FileNotFoundError:
+if not refiner_registry.reload():
     print("--- DSPy: No optimized module found. Using default prompts. ---")
     
 
-def refine_solution_with_dspy(question: str, original_solution: str, user_feedback: str) -> str:
+def refine_solution_with_dspy(question: str, original_solution: str, user_feedback: str,
+                              context: str | None = None) -> str | None:
     """
     Uses the initialized DSPy module to refine an answer.
+    `context` is the retrieval context the original answer was built from, if known.
+    Returns None if no refinement could be made, so error text is never
+    mistaken for an answer (and stored or learned).
     """
     print("--- DSPy: Refining solution with feedback ---")
     if not dspy_gemini_lm:
         print("--- DSPy: Error, LM not configured. ---")
-        return "Error: DSPy is not configured."
+        return None
         
     try:
-        # Run the DSPy program
+        # Run the DSPy program (whichever version is live right now)
+        dspy_refiner = refiner_registry.module
         prediction = dspy_refiner(
             question=question,
             original_solution=original_solution,
-            user_feedback=user_feedback
+            user_feedback=user_feedback,
+            context=context or ""
         )
         print("--- DSPy: Refinement complete. ---")
-        return prediction.refined_solution
+        return prediction.refined_solution or None
     except Exception as e:
         print(f"--- DSPy: Error during refinement: {e} ---")
-        return f"Sorry, I encountered an error while refining the solution: {e}"
+        return None
 
@@ -2,6 +2,7 @@ import json
 from fastapi import HTTPException
 from langchain_core.prompts import ChatPromptTemplate
 from app.core.clients import llm_gemini # Use our shared client
+from app.core.shared_cache import shared_cache
 
 # --- 1. Input Guardrail (LLM-based) ---
 
@@ -40,6 +41,13 @@ def check_input_guardrail(question: str) -> (bool, str):
     """
     Checks user input. Returns (is_safe, reason).
     """
+    # Verdicts are shared by all workers on the node.
+    cache_key = shared_cache.question_key(question)
+    cached = shared_cache.get("guardrail_input", cache_key)
+    if cached is not None:
+        print(f"--- Guardrail: Input verdict from cache (is_safe={cached['is_safe']}) ---")
+        return (cached["is_safe"], cached["reason"])
+
     print("--- Guardrail: Checking Input (Gemini) ---")
     prompt = ChatPromptTemplate.from_template(INPUT_GUARDRAIL_PROMPT)
     chain = prompt | llm_gemini
@@ -51,6 +59,12 @@ def check_input_guardrail(question: str) -> (bool, str):
         
         is_safe = result.get("is_safe", False)
         reason = result.get("reason", "Unknown error")
+        if "is_safe" in result:
+            # Don't cache parse failures, only real verdicts.
+            shared_cache.set("guardrail_input", cache_key, {
+                "is_safe": bool(is_safe),
+                "reason": reason if not is_safe else "OK"
+            })
         
         if not is_safe:
             print(f"--- Guardrail: Input BLOCKED. Reason: {reason} ---")
@@ -0,0 +1,55 @@
+import re
+import hashlib
+
+# --- Stored-answer fast path helpers ---
+# When a question is already in the KB (word for word, or nearly), we can
+# return its stored steps and answer directly instead of asking Gemini to
+# rewrite them. These helpers are shared with the ingestion script, so
+# they must stay free of client imports.
+
+KB_EXACT_SOURCE = "knowledge_base_exact"
+
+KB_ANSWER_TEMPLATE = """This question is already in our knowledge base, so here is its worked solution.
+
+**Question:**
+{question}
+
+**Step-by-Step Solution:**
+{steps}
+
+**Final Answer:** {answer}
+"""
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercases, drops punctuation and collapses whitespace, so trivial
+    copy/paste differences don't change the hash. Decimal points and
+    math operators are kept ("2.5" must not become "25").
+    """
+    text = question.lower()
+    text = re.sub(r"(?<!\d)[.,]|[.,](?!\d)|[!?;:'\"`]", " ", text)
+    return " ".join(text.split())
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+def question_numbers(question: str) -> tuple:
+    """The numbers in a question, in order ("1,200" -> "1200")."""
+    return tuple(n.replace(",", "") for n in re.findall(r"\d[\d,]*(?:\.\d+)?", normalize_question(question)))
+
+def same_numbers(question: str, other: str) -> bool:
+    """
+    Near-identical wording isn't enough to reuse an answer: GSM8K-style
+    variants differ only in a number ("48 friends" vs "50 friends").
+    """
+    return question_numbers(question) == question_numbers(other)
+
+def format_kb_answer(payload: dict) -> str:
+    """Renders a KB point's stored solution without calling an LLM."""
+    # GSM8K steps carry calculator annotations like "<<48/2=24>>".
+    steps = re.sub(r"<<[^>]*>>", "", payload.get("steps", "")).strip()
+    return KB_ANSWER_TEMPLATE.format(
+        question=payload["question"].strip(),
+        steps=steps,
+        answer=payload.get("answer", "").strip()
+    )
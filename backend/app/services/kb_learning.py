@@ -0,0 +1,182 @@
+import os
+import re
+import uuid
+import queue
+import threading
+from datetime import datetime
+import numpy as np
+from qdrant_client.http.models import PointStruct
+from app.core.clients import qdrant_client, embedding_cache, REPLAYING
+from app.core.shared_cache import shared_cache
+from app.services.topics import classify_topic, estimate_difficulty
+from app.services.kb_answers import question_hash, same_numbers
+from app.services.rag_pipeline import KB_COLLECTION, find_exact_kb_match, kb_hash_index
+
+# --- Online KB learning ---
+# Answers a student rated "good", and refined answers that passed the output
+# guardrail, are queued here. A background thread batch-embeds them (through
+# the embedding cache), drops near-duplicates and upserts the rest into the
+# KB collection, tagged like ingested points plus `dataset: "learned"`.
+# Next time the same question is asked it is a KB hit (often the direct
+# fast path) instead of a web search plus generation.
+#
+# Point ids are derived from the question hash, so two workers learning the
+# same question write the same point, and a later refinement replaces an
+# earlier learned answer instead of adding a second one.
+
+LEARNED_DATASET = "learned"
+KB_LEARN_ENABLED = os.environ.get("KB_LEARN_ENABLED", "1") != "0" and not REPLAYING
+KB_LEARN_INTERVAL = float(os.environ.get("KB_LEARN_INTERVAL", "30"))  # seconds between flushes
+KB_LEARN_BATCH_SIZE = int(os.environ.get("KB_LEARN_BATCH_SIZE", "32"))
+# A KB question at least this similar, and with the same numbers, counts
+# as the same question. GSM8K-style variants ("48 clips" vs "50 clips")
+# score above this but need their own answer.
+KB_LEARN_DEDUP_THRESHOLD = float(os.environ.get("KB_LEARN_DEDUP_THRESHOLD", "0.95"))
+
+# Answers from these paths are already in the KB, or not worth storing.
+SKIPPED_SOURCES = {"knowledge_base_exact", "local_solver", "error"}
+
+_FINAL_ANSWER_RE = re.compile(r"^[\s*#]*final answer[\s*:]*(.+?)[\s*]*$", re.IGNORECASE | re.MULTILINE)
+
+def split_solution(solution: str) -> tuple[str, str]:
+    """Splits a generated solution into (steps, final answer) for the KB payload."""
+    matches = list(_FINAL_ANSWER_RE.finditer(solution))
+    if matches:
+        last = matches[-1]
+        steps = (solution[:last.start()] + solution[last.end():]).strip()
+        return steps, last.group(1).strip()
+    lines = [line for line in solution.strip().splitlines() if line.strip()]
+    return solution.strip(), (lines[-1].strip() if lines else "")
+
+class KBLearner:
+    def __init__(self, enabled: bool = KB_LEARN_ENABLED):
+        self.enabled = enabled and qdrant_client is not None
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def enqueue(self, question: str, solution: str, source: str):
+        """Queues an approved answer. Cheap; the work happens on the worker thread."""
+        if not self.enabled or source in SKIPPED_SOURCES or not question or not solution:
+            return
+        self._queue.put({"question": question, "solution": solution, "source": source})
+        shared_cache.incr("kb_learning.queued")
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < KB_LEARN_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _is_duplicate(self, item: dict, vector: np.ndarray) -> bool:
+        existing = find_exact_kb_match(item["question"])
+        if existing is not None:
+            # Curated points win; a learned one is replaced by the newer answer.
+            return existing.get("dataset") != LEARNED_DATASET
+        hits = qdrant_client.search(
+            collection_name=KB_COLLECTION,
+            query_vector=vector.tolist(),
+            limit=5,
+            score_threshold=KB_LEARN_DEDUP_THRESHOLD
+        )
+        return any(same_numbers(item["question"], hit.payload.get("question", "")) for hit in hits)
+
+    def flush(self, batch: list) -> int:
+        """Embeds, dedupes and upserts one batch. Returns the number of points written."""
+        # Within the batch, the latest answer for a question wins (e.g. a refinement).
+        latest = {}
+        for item in batch:
+            latest[question_hash(item["question"])] = item
+        items = list(latest.values())
+        vectors = embedding_cache.encode([item["question"] for item in items])
+
+        points, kept = [], []
+        normalized = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        for index, (item, vector) in enumerate(zip(items, vectors)):
+            if any(float(normalized[index] @ normalized[k]) >= KB_LEARN_DEDUP_THRESHOLD
+                   and same_numbers(item["question"], items[k]["question"]) for k in kept):
+                shared_cache.incr("kb_learning.duplicates")
+                continue
+            if self._is_duplicate(item, vector):
+                shared_cache.incr("kb_learning.duplicates")
+                continue
+            kept.append(index)
+
+            digest = question_hash(item["question"])
+            steps, answer = split_solution(item["solution"])
+            topic, _ = classify_topic(item["question"])
+            points.append(PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"learned:{digest}")),
+                vector=vector.tolist(),
+                payload={
+                    "question": item["question"],
+                    "answer": answer,
+                    "steps": steps,
+                    "topic": topic,
+                    "difficulty": estimate_difficulty(item["question"], steps),
+                    "dataset": LEARNED_DATASET,
+                    "question_hash": digest,
+                    "learned_from": item["source"],
+                    "learned_at": datetime.utcnow().isoformat(),
+                }
+            ))
+
+        if points:
+            qdrant_client.upsert(collection_name=KB_COLLECTION, points=points, wait=True)
+            for point in points:
+                kb_hash_index.add(point.payload["question_hash"], point.id)
+            shared_cache.incr("kb_learning.inserted", len(points))
+            # Cached answers for these questions would otherwise shadow the new KB entries.
+            for item in items:
+                shared_cache.delete("answers", shared_cache.question_key(item["question"]))
+        print(f"--- KB Learning: {len(points)} learned, {len(batch) - len(points)} skipped as duplicates. ---")
+        return len(points)
+
+    def _run_once(self):
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            try:
+                self.flush(batch)
+            except Exception as e:
+                print(f"--- KB Learning: Flush failed, dropping {len(batch)} answers: {e} ---")
+                shared_cache.incr("kb_learning.errors", len(batch))
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            self._run_once()
+        self._run_once()  # Don't lose what was queued before shutdown.
+
+    def start_worker(self, interval: float = KB_LEARN_INTERVAL):
+        """Starts the background ingestion thread (once per process)."""
+        if not self.enabled:
+            print("--- KB Learning: Disabled. ---")
+            return
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._watch, args=(interval,), daemon=True, name="kb-learner")
+        self._worker.start()
+        print(f"--- KB Learning: Flushing learned answers every {interval}s. ---")
+
+    def stop_worker(self, timeout: float = 10):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        counters = shared_cache.counters("kb_learning.")
+        return {
+            "enabled": self.enabled,
+            "pending": self._queue.qsize(),  # this worker only
+            "queued": int(counters.get("kb_learning.queued", 0)),
+            "inserted": int(counters.get("kb_learning.inserted", 0)),
+            "duplicates": int(counters.get("kb_learning.duplicates", 0)),
+            "errors": int(counters.get("kb_learning.errors", 0)),
+        }
+
+kb_learner = KBLearner()
@@ -1,11 +1,23 @@
+import os
+import time
+import threading
+from datetime import datetime
+from typing import NamedTuple
 from app.core.clients import (
     qdrant_client, 
-    embedding_model, 
+    embedding_cache, 
     tavily_client, 
-    llm_gemini
+    llm_gemini,
+    llm_gemini_lite
 )
+from app.core.shared_cache import shared_cache
+from app.services.topics import classify_topic, estimate_difficulty, TOPIC_ROUTING_MIN_CONFIDENCE
+from app.services.cascade import (
+    Tier, run_cascade, CascadeExhausted, solve_arithmetic, record_local_solver, LOCAL_SOLVER_SOURCE
+)
+from app.services.kb_answers import question_hash, format_kb_answer, same_numbers, KB_EXACT_SOURCE
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
 # --- RAG Prompt Template ---
 MATH_PROFESSOR_PROMPT = """
@@ -22,7 +34,7 @@ You will be given a user's question and some context (if any was found).
 1.  Acknowledge the user's question.
 2.  Provide a **simplified, step-by-step solution** as if explaining it to a student.
 3.  Break down complex terms.
-4.  End with the final, clear answer.
+4.  End with the final, clear answer on its own line, as: **Final Answer:** <answer>
 
 **Context:**
 {context}
@@ -33,9 +45,116 @@ You will be given a user's question and some context (if any was found).
 **Your Step-by-Step Solution:**
 """
 
-def search_knowledge_base(question: str) -> str | None:
+KB_COLLECTION = "math_problems" # Must match ingest script
+KB_SCORE_THRESHOLD = 0.60 # Flexible threshold
+# At or above this dense score, and with the same numbers, the KB question is
+# (almost) the same as the user's, so the stored solution is returned
+# without calling Gemini.
+KB_DIRECT_ANSWER_THRESHOLD = float(os.environ.get("KB_DIRECT_ANSWER_THRESHOLD", "0.97"))
+
+class KBHit(NamedTuple):
+    payload: dict
+    score: float
+    exact: bool # Matched on the normalized-question hash
+
+# How often each worker reloads its question_hash index, to pick up points
+# added by other workers or by re-running ingestion.
+KB_HASH_INDEX_REFRESH = float(os.environ.get("KB_HASH_INDEX_REFRESH", "600"))
+
+class KBHashIndex:
     """
-    Searches the Qdrant VectorDB for a relevant math problem.
+    question_hash -> point id for the whole KB, kept in each worker so an
+    exact-match lookup is a dict hit (plus one retrieve on a hit) instead
+    of a Qdrant scroll on every query. ~9k GSM8K points take about 2 MB.
+    Loaded on first use (or at startup), reloaded every
+    KB_HASH_INDEX_REFRESH seconds, and updated by the KB learner.
+    """
+    def __init__(self, refresh: float = KB_HASH_INDEX_REFRESH):
+        self.refresh = refresh
+        self._ids = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh
+
+    def _load(self) -> dict:
+        ids, offset = {}, None
+        while True:
+            points, offset = qdrant_client.scroll(
+                collection_name=KB_COLLECTION,
+                limit=1000,
+                offset=offset,
+                with_payload=["question_hash"],
+                with_vectors=False
+            )
+            for point in points:
+                digest = (point.payload or {}).get("question_hash")
+                if digest:
+                    ids.setdefault(digest, point.id)
+            if offset is None:
+                return ids
+
+    def warm(self):
+        """Loads (or reloads, when stale) the index. Only the first load blocks lookups."""
+        if qdrant_client is None or self._fresh():
+            return
+        if not self._lock.acquire(blocking=self._ids is None):
+            return  # Another thread is reloading; keep using the current index.
+        try:
+            if self._fresh():
+                return
+            try:
+                self._ids = self._load()
+                print(f"--- RAG: Loaded question_hash index ({len(self._ids)} KB questions). ---")
+            except Exception as e:
+                print(f"--- RAG: Could not load question_hash index: {e} ---")
+            self._loaded_at = time.monotonic()  # On failure, retry after the refresh interval.
+        finally:
+            self._lock.release()
+
+    def add(self, digest: str, point_id):
+        if self._ids is not None:
+            self._ids[digest] = point_id
+
+    def get(self, question: str) -> dict | None:
+        self.warm()
+        if not self._ids:
+            return None
+        digest = question_hash(question)
+        point_id = self._ids.get(digest)
+        if point_id is None:
+            return None
+        points = qdrant_client.retrieve(
+            collection_name=KB_COLLECTION,
+            ids=[point_id],
+            with_payload=True,
+            with_vectors=False
+        )
+        if not points:  # Deleted since the index was loaded.
+            self._ids.pop(digest, None)
+            return None
+        return points[0].payload
+
+    def stats(self) -> dict:
+        return {"loaded": self._ids is not None, "questions": len(self._ids or {})}
+
+kb_hash_index = KBHashIndex()
+
+def find_exact_kb_match(question: str) -> dict | None:
+    """
+    Looks the normalized question up in this worker's question_hash index.
+    This is a keyword lookup, so it needs no embedding, and a miss costs
+    no Qdrant request.
+    """
+    return kb_hash_index.get(question)
+
+def lookup_knowledge_base(question: str) -> KBHit | None:
+    """
+    Finds the best KB point for the question: an exact (hash) match if
+    there is one, otherwise the top dense hit above KB_SCORE_THRESHOLD.
+    The dense query is routed to its topic shard (payload filter on
+    `topic`) when the local classifier is confident about the topic.
     """
     if not qdrant_client:
         print("--- RAG: Qdrant client not available. Skipping KB search. ---")
@@ -43,39 +162,76 @@ def search_knowledge_base(question: str) -> str | None:
         
     print("--- RAG: Searching Knowledge Base ---")
     try:
-        vector = embedding_model.encode(question).tolist()
+        payload = find_exact_kb_match(question)
+        if payload:
+            print("--- RAG: Exact question match in KB. ---")
+            return KBHit(payload, 1.0, True)
+
+        vector = embedding_cache.encode(question).tolist()
+
+        topic, confidence = classify_topic(question)
+        topic_filter = None
+        if confidence >= TOPIC_ROUTING_MIN_CONFIDENCE:
+            print(f"--- RAG: Routing to topic shard '{topic}' (confidence: {confidence:.2f}) ---")
+            topic_filter = Filter(must=[FieldCondition(key="topic", match=MatchValue(value=topic))])
         
         search_result = qdrant_client.search(
-            collection_name="math_problems", # Must match ingest script
+            collection_name=KB_COLLECTION,
             query_vector=vector,
+            query_filter=topic_filter,
             limit=1,
-            score_threshold=0.60 # Flexible threshold
+            score_threshold=KB_SCORE_THRESHOLD
         )
+
+        if not search_result and topic_filter is not None:
+            # The classifier may have picked the wrong shard.
+            print(f"--- RAG: No hit in shard '{topic}'. Searching all topics. ---")
+            search_result = qdrant_client.search(
+                collection_name=KB_COLLECTION,
+                query_vector=vector,
+                limit=1,
+                score_threshold=KB_SCORE_THRESHOLD
+            )
         
         if not search_result:
-            print("--- RAG: No KB result found (Score < 0.60). ---")
+            print(f"--- RAG: No KB result found (Score < {KB_SCORE_THRESHOLD:.2f}). ---")
             return None
         
-        top_score = search_result[0].score
-        payload = search_result[0].payload
-        context = (
-            f"Found a similar problem (score: {top_score:.2f}):\n"
-            f"Question: {payload['question']}\n"
-            f"Solution: {payload['answer']}\n"
-            f"Steps: {payload['steps']}"
-        )
-        print(f"--- RAG: Found KB context. Score: {top_score} ---")
-        return context
+        print(f"--- RAG: Found KB context. Score: {search_result[0].score} ---")
+        return KBHit(search_result[0].payload, search_result[0].score, False)
 
     except Exception as e:
         print(f"--- RAG: Error in KB search: {e} ---")
         return None
 
+def format_kb_context(hit: KBHit) -> str:
+    payload = hit.payload
+    return (
+        f"Found a similar problem (score: {hit.score:.2f}):\n"
+        f"Question: {payload['question']}\n"
+        f"Solution: {payload['answer']}\n"
+        f"Steps: {payload['steps']}"
+    )
+
+def search_knowledge_base(question: str) -> str | None:
+    """
+    Searches the Qdrant VectorDB for a relevant math problem.
+    Returns it formatted as context for the LLM.
+    """
+    hit = lookup_knowledge_base(question)
+    return format_kb_context(hit) if hit else None
+
 def search_web_mcp(question: str) -> str | None:
     """
     Performs a web search using Tavily.
     This simulates your MCP pipeline's functionality.
     """
+    cache_key = shared_cache.question_key(question)
+    cached = shared_cache.get("web_search", cache_key)
+    if cached is not None:
+        print("--- RAG: Web context from cache. ---")
+        return cached
+
     print("--- RAG: No KB hit. Searching Web (Simulating MCP)... ---")
     try:
         response = tavily_client.search(
@@ -90,25 +246,105 @@ def search_web_mcp(question: str) -> str | None:
             context += f"URL: {result['url']}\nContent: {result['content']}\n\n"
         
         print("--- RAG: Found Web context. ---")
+        shared_cache.set("web_search", cache_key, context)
         return context
     
     except Exception as e:
         print(f"--- RAG: Error in Web/MCP search: {e} ---")
         return None
 
+# Sources that count as a KB hit / a web fallback in the daily history.
+KB_HIT_SOURCES = ("knowledge_base", KB_EXACT_SOURCE)
+WEB_FALLBACK_SOURCES = ("web_search",)
+
+def record_answer_source(source: str):
+    """
+    Counts which path served each answer (shared across workers, see /stats),
+    in total and per UTC day, so the KB hit rate can be followed over time.
+    """
+    shared_cache.incr(f"answers.source.{source}")
+    shared_cache.incr(f"answers.daily.{datetime.utcnow():%Y-%m-%d}.{source}")
+
+def answer_source_history(days: int = 14) -> list:
+    """KB-hit and web-fallback rates for each of the last `days` days that saw traffic."""
+    per_day = {}
+    for name, count in shared_cache.counters("answers.daily.").items():
+        _, _, day, source = name.split(".", 3)
+        per_day.setdefault(day, {})[source] = int(count)
+
+    history = []
+    for day in sorted(per_day)[-days:]:
+        sources = per_day[day]
+        # Answer-cache hits repeat an earlier answer, so they don't say where it came from.
+        total = sum(count for source, count in sources.items() if source != "answer_cache")
+        history.append({
+            "day": day,
+            "answers": total,
+            "kb_hit_rate": sum(sources.get(s, 0) for s in KB_HIT_SOURCES) / total if total else 0.0,
+            "web_fallback_rate": sum(sources.get(s, 0) for s in WEB_FALLBACK_SOURCES) / total if total else 0.0,
+            "sources": sources,
+        })
+    return history
+
+def generation_tiers(difficulty: str) -> list[Tier]:
+    """Easy questions try the lite model first; everything else goes straight to the strong one."""
+    if difficulty == "easy":
+        return [Tier("lite", llm_gemini_lite), Tier("strong", llm_gemini)]
+    return [Tier("strong", llm_gemini)]
+
 async def generate_solution(question: str) -> (str, str):
     """
     The main RAG pipeline function.
     Returns: (solution, source)
     """
+    solution, source, _ = await run_pipeline(question)
+    return solution, source
+
+async def run_pipeline(question: str) -> (str, str, str | None):
+    """
+    Same as generate_solution, but also returns the context the solution
+    was generated from (kept in the thread store for refinement).
+    Returns: (solution, source, context)
+    """
+    cache_key = shared_cache.question_key(question)
+    cached = shared_cache.get("answers", cache_key)
+    if cached is not None:
+        print(f"--- RAG: Answer from cache (source: {cached['source']}) ---")
+        record_answer_source("answer_cache")
+        return cached["solution"], cached["source"], cached.get("context")
+
     context = None
     source = "none"
+    difficulty = estimate_difficulty(question)
+
+    # 0. Pure arithmetic ("5+5-19*5 =?") is solved locally, no retrieval or LLM.
+    if difficulty == "easy":
+        start = time.perf_counter()
+        solution = solve_arithmetic(question)
+        if solution:
+            print("--- RAG: Solved locally (arithmetic). ---")
+            record_local_solver(time.perf_counter() - start)
+            shared_cache.set("answers", cache_key, {"solution": solution, "source": LOCAL_SOLVER_SOURCE})
+            record_answer_source(LOCAL_SOLVER_SOURCE)
+            return solution, LOCAL_SOLVER_SOURCE, None
 
     # 1. Try Knowledge Base (RAG)
-    context_kb = search_knowledge_base(question)
+    kb_hit = lookup_knowledge_base(question)
+
+    # 1a. Fast path: the question is already in the KB, serve the stored solution.
+    #     A dense match also needs the same numbers; otherwise it's only context.
+    if kb_hit and (kb_hit.exact or (
+        kb_hit.score >= KB_DIRECT_ANSWER_THRESHOLD and same_numbers(question, kb_hit.payload["question"])
+    )):
+        print(f"--- RAG: Serving stored KB solution (score: {kb_hit.score:.2f}) ---")
+        solution = format_kb_answer(kb_hit.payload)
+        context = format_kb_context(kb_hit)
+        shared_cache.set("answers", cache_key, {"solution": solution, "source": KB_EXACT_SOURCE, "context": context})
+        record_answer_source(KB_EXACT_SOURCE)
+        return solution, KB_EXACT_SOURCE, context
     
-    if context_kb:
-        context = context_kb
+    if kb_hit:
+        context = format_kb_context(kb_hit)
         source = "knowledge_base"
     else:
         # 2. Fallback to Web Search (MCP)
@@ -121,19 +357,31 @@ async def generate_solution(question: str) -> (str, str):
         context = "No additional context found. Solve the problem directly."
         source = "direct_answer"
 
-    # 3. Generate the solution
-    print(f"--- RAG: Generating solution with source: {source} ---")
+    # 3. Generate the solution (cheapest tier that passes the self-check)
+    print(f"--- RAG: Generating solution with source: {source} (difficulty: {difficulty}) ---")
     prompt = ChatPromptTemplate.from_template(MATH_PROFESSOR_PROMPT)
-    chain = prompt | llm_gemini | StrOutputParser()
     
     try:
-        solution = await chain.ainvoke({
+        solution, _ = await run_cascade(prompt, {
             "source": source,
             "context": context,
             "question": question
-        })
-        return solution, source
+        }, generation_tiers(difficulty))
+        shared_cache.set("answers", cache_key, {"solution": solution, "source": source, "context": context})
+        record_answer_source(source)
+        return solution, source, context
+    except CascadeExhausted as e:
+        if e.raised:
+            # The model errored (e.g. Gemini is down): this is not a KB/web answer.
+            print(f"--- RAG: Error in final LLM generation: {e} ---")
+            record_answer_source("error")
+            return f"Sorry, I encountered an error while generating the solution: {e}", "error", context
+        # The output guardrail in /ask reports why; don't cache it.
+        print(f"--- RAG: No tier passed the self-check: {e} ---")
+        record_answer_source(source)
+        return e.solution, source, context
     except Exception as e:
         print(f"--- RAG: Error in final LLM generation: {e} ---")
-        return f"Sorry, I encountered an error while generating the solution: {e}", "error"
+        record_answer_source("error")
+        return f"Sorry, I encountered an error while generating the solution: {e}", "error", context
 
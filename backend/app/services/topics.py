@@ -0,0 +1,97 @@
+import re
+
+# --- Cheap local topic / difficulty classifier ---
+# Keyword scoring only (no model, no network), so it can run on every
+# request and inside the ingestion script. Used to tag KB points at
+# ingestion and to route queries to a topic shard at search time.
+
+TOPICS = ("arithmetic", "algebra", "geometry", "calculus", "probability")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# Only route a query to its topic shard when the classifier is fairly
+# sure; otherwise the whole collection is searched.
+TOPIC_ROUTING_MIN_CONFIDENCE = 0.6
+
+TOPIC_KEYWORDS = {
+    "calculus": [
+        r"\bderivative", r"\bdifferentiat", r"\bintegra", r"\blimit\b", r"\blim\b",
+        r"d/dx", r"dy/dx", r"\bmaxim", r"\bminim", r"\bsin\b", r"\bcos\b", r"\btan\b",
+        r"\bln\b", r"\blog\b", r"\be\^", r"\bseries\b", r"\bconverge",
+    ],
+    "algebra": [
+        r"\bsolve for\b", r"\bequation", r"\bpolynomial", r"\bquadratic", r"\broots?\b",
+        r"\bfactor", r"\bx\^2\b", r"\b[xyz]\s*=", r"\bvariable", r"\binequalit",
+        r"\bmatri", r"\bdeterminant", r"\bsequence", r"\bprogression", r"\bfunction",
+    ],
+    "geometry": [
+        r"\btriangle", r"\bcircle", r"\bradius", r"\bdiameter", r"\bangle", r"\barea\b",
+        r"\bperimeter", r"\bvolume", r"\bpolygon", r"\brectangle", r"\bsquare\b",
+        r"\bhypotenuse", r"\bparallel", r"\bperpendicular", r"\bcoordinate", r"\bparabola",
+    ],
+    "probability": [
+        r"\bprobabilit", r"\bdice\b", r"\bdie\b", r"\bcoin", r"\brandom", r"\bexpected value",
+        r"\bcombination", r"\bpermutation", r"\bchoose\b", r"\bodds\b", r"\bdeck\b",
+        r"\bmean\b", r"\bmedian\b", r"\bvariance",
+    ],
+    "arithmetic": [
+        r"\$\d", r"\bpercent", r"%", r"\bhow many\b", r"\bhow much\b", r"\btotal\b",
+        r"\beach\b", r"\bper\b", r"\bhalf\b", r"\btwice\b", r"\bcost", r"\bdollars?\b",
+        r"\bhours?\b", r"\bminutes?\b", r"\bsum\b", r"\bdifference\b",
+    ],
+}
+_COMPILED = {
+    topic: [re.compile(p, re.IGNORECASE) for p in patterns]
+    for topic, patterns in TOPIC_KEYWORDS.items()
+}
+
+# Topics that imply a harder problem when they show up.
+_HARD_TOPICS = {"calculus", "probability"}
+
+def topic_scores(text: str) -> dict:
+    """Number of keyword hits per topic."""
+    return {
+        topic: sum(1 for pattern in patterns if pattern.search(text))
+        for topic, patterns in _COMPILED.items()
+    }
+
+def classify_topic(text: str) -> tuple[str, float]:
+    """
+    Returns (topic, confidence). Confidence is the top topic's share of
+    all keyword hits (0.0 when nothing matched, in which case the topic
+    is "arithmetic", the most common kind of question we get).
+    """
+    scores = topic_scores(text)
+    total = sum(scores.values())
+    if total == 0:
+        return "arithmetic", 0.0
+    topic = max(TOPICS, key=lambda t: scores[t])
+    return topic, scores[topic] / total
+
+def estimate_difficulty(text: str, steps: str | None = None) -> str:
+    """
+    Rough difficulty from the question (and, at ingestion, the worked
+    solution): longer problems, more quantities, more solution steps and
+    harder topics all push it up.
+    """
+    points = 0
+    words = len(text.split())
+    numbers = len(re.findall(r"\d+(?:\.\d+)?", text))
+    if words > 60:
+        points += 1
+    if words > 120:
+        points += 1
+    if numbers > 4:
+        points += 1
+    if steps is not None and steps.count("\n") + 1 > 4:
+        points += 1
+    topic, confidence = classify_topic(text)
+    if topic in _HARD_TOPICS and confidence >= 0.5:
+        points += 1
+    if re.search(r"[∫∑√π]|\\(frac|int|sum|sqrt)", text):
+        points += 1
+
+    if points == 0:
+        return "easy"
+    if points <= 2:
+        return "medium"
+    return "hard"
@@ -0,0 +1,80 @@
+"""
+Offline per-stage benchmarks for the Math Agent pipeline.
+
+External services (Gemini, Qdrant, Tavily) are replayed from a cassette
+(see app/core/recording.py), so these numbers are our own overhead:
+prompt building, parsing, embedding, caching, etc.
+
+1. Record the cassette once (needs the real API keys in .env):
+
+    cd backend
+    CASSETTE_MODE=record pytest benchmarks/bench_pipeline.py --benchmark-disable
+
+2. Save a baseline, then compare every later run against it:
+
+    pytest benchmarks/bench_pipeline.py --benchmark-autosave
+    pytest benchmarks/bench_pipeline.py --benchmark-compare --benchmark-compare-fail=median:25%
+
+   Add REPLAY_LATENCY=recorded to replay with production-like latencies.
+
+Requires pytest-benchmark (pip install pytest-benchmark).
+"""
+import os
+import sys
+import asyncio
+
+# Must be set before anything imports app.core.clients.
+os.environ.setdefault("CASSETTE_MODE", "replay")
+os.environ.setdefault("SHARED_CACHE_ENABLED", "0")  # measure the pipeline, not the cache
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.core.recording import CASSETTE_MODE, CASSETTE_PATH
+
+if CASSETTE_MODE == "replay" and not os.path.exists(CASSETTE_PATH):
+    pytest.skip(f"No cassette at {CASSETTE_PATH}. Record one first (see module docstring).",
+                allow_module_level=True)
+
+from app.services.guardrails import check_input_guardrail, check_output_guardrail
+from app.services.rag_pipeline import search_knowledge_base, search_web_mcp, generate_solution
+from app.services.dspy_feedback import refine_solution_with_dspy
+
+KB_QUESTION = (
+    "Natalia sold clips to 48 of her friends in April, and then she sold half as many "
+    "clips in May. How many clips did Natalia sell altogether in April and May?"
+)
+WEB_QUESTION = "Evaluate the integral of x * e^x from 0 to 1."
+FEEDBACK = "You skipped the integration by parts step. Please show u and dv explicitly."
+
+@pytest.fixture(scope="module")
+def web_solution():
+    solution, _ = asyncio.run(generate_solution(WEB_QUESTION))
+    return solution
+
+def test_input_guardrail(benchmark):
+    is_safe, _ = benchmark(check_input_guardrail, KB_QUESTION)
+    assert is_safe
+
+def test_output_guardrail(benchmark, web_solution):
+    is_safe, _ = benchmark(check_output_guardrail, web_solution)
+    assert is_safe
+
+def test_search_knowledge_base(benchmark):
+    context = benchmark(search_knowledge_base, KB_QUESTION)
+    assert context
+
+def test_search_web(benchmark):
+    context = benchmark(search_web_mcp, WEB_QUESTION)
+    assert context
+
+@pytest.mark.parametrize("question", [KB_QUESTION, WEB_QUESTION], ids=["kb", "web"])
+def test_generate_solution(benchmark, question):
+    solution, source = benchmark(lambda: asyncio.run(generate_solution(question)))
+    assert source != "error", solution
+
+def test_refine_solution(benchmark, web_solution):
+    refined = benchmark(refine_solution_with_dspy, WEB_QUESTION, web_solution, FEEDBACK)
+    assert refined
@@ -0,0 +1,38 @@
+import os
+import gc
+
+# --- Multi-worker deployment ---
+# Run with:  gunicorn -c gunicorn.conf.py app.main:app
+#
+# preload_app imports app.main (and so app.core.clients, which loads the
+# SentenceTransformer weights) once in the master process, *before*
+# forking. Workers then share those pages copy-on-write instead of each
+# loading their own copy. Network clients (Gemini, Qdrant, Tavily) are not
+# built in the master: each worker builds its own on first use, so no
+# connection pool or socket is shared across the fork. Caches live in the SQLite file
+# from app.core.shared_cache, which all workers on the node read and write.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '7860')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+# gRPC-based clients must be told they may be used across fork().
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "1")
+
+def when_ready(server):
+    # Move everything allocated during preload into the permanent GC
+    # generation, so the collector in each worker doesn't touch (and copy)
+    # the shared model pages.
+    gc.freeze()
+    server.log.info(f"Preloaded app, {gc.get_freeze_count()} objects frozen before fork.")
+
+def post_fork(server, worker):
+    # Split the CPU between workers instead of every worker's torch
+    # thread pool using all cores.
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except ImportError:
+        pass
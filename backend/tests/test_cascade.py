@@ -0,0 +1,78 @@
+"""
+Generation cascade (app/services/cascade.py) with local stand-in models.
+
+    cd backend
+    pytest tests/test_cascade.py
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+# Must be set before anything imports app.core.clients: no real clients are built.
+os.environ.setdefault("CASSETTE_MODE", "replay")
+os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "cache.sqlite"))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.services.cascade import Tier, CascadeExhausted, run_cascade, self_check, solve_arithmetic
+
+PROMPT = ChatPromptTemplate.from_template("{question}")
+GOOD = "48 / 2 = 24\n24 + 48 = 72\n\n**Final Answer:** 72"
+
+class FailingChatModel(FakeListChatModel):
+    """Stands in for a tier whose API is down."""
+    async def _agenerate(self, *args, **kwargs):
+        raise ConnectionError("model unavailable")
+
+def cascade(*tiers):
+    return asyncio.run(run_cascade(PROMPT, {"question": "How many clips?"}, list(tiers)))
+
+@pytest.mark.parametrize("solution,ok", [
+    (GOOD, True),
+    ("The answer is \\boxed{72}.", True),
+    ("48 / 2 = 24, so she sold 72 clips.", False),            # no final answer line
+    ("48 / 2 = 23\n**Final Answer:** 71", False),              # arithmetic slip
+    ("10 / 3 = 3.33\n**Final Answer:** 3.33", True),           # rounded step
+    ("1,200 + 300 = 1,500\n**Final Answer:** 1,500", True),    # thousands separators
+    ("2,400 - 400 = 2,000\n**Final Answer:** 2,000", True),
+    ("x = -5 + 3 = -2\n**Final Answer:** -2", True),            # unary minus
+    ("1,200 + 300 = 1,600\n**Final Answer:** 1,600", False),
+    ("**Final Answer:** It cannot be determined.", False),
+    ("I'm sorry, I cannot answer that.", False),                # refusal guardrail
+])
+def test_self_check(solution, ok):
+    assert self_check(solution)[0] is ok
+
+def test_lite_answer_that_passes_is_served():
+    solution, tier = cascade(Tier("lite", FakeListChatModel(responses=[GOOD])),
+                             Tier("strong", FakeListChatModel(responses=["unused"])))
+    assert (solution, tier) == (GOOD, "lite")
+
+def test_wrong_lite_answer_escalates():
+    wrong = "48 / 2 = 26\n26 + 48 = 74\n\n**Final Answer:** 74"
+    solution, tier = cascade(Tier("lite", FakeListChatModel(responses=[wrong])),
+                             Tier("strong", FakeListChatModel(responses=[GOOD])))
+    assert (solution, tier) == (GOOD, "strong")
+
+def test_erroring_last_tier_is_reported_as_raised():
+    with pytest.raises(CascadeExhausted) as excinfo:
+        cascade(Tier("lite", FakeListChatModel(responses=["no answer"])),
+                Tier("strong", FailingChatModel(responses=[""])))
+    assert excinfo.value.raised
+    assert excinfo.value.solution is None
+
+def test_failed_self_check_keeps_last_answer():
+    with pytest.raises(CascadeExhausted) as excinfo:
+        cascade(Tier("strong", FakeListChatModel(responses=["no answer"])))
+    assert not excinfo.value.raised
+    assert excinfo.value.solution == "no answer"
+
+def test_solve_arithmetic():
+    solution = solve_arithmetic("5+5-19*5 =?")
+    assert solution.endswith("**Final Answer:** -85")
+    assert self_check(solution)[0]
+    assert solve_arithmetic("How many apples does Tom have?") is None
@@ -0,0 +1,58 @@
+"""
+Answer extraction / local scoring in scripts/score_benchmark.py.
+
+    cd backend
+    pytest tests/test_score_benchmark.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'scripts')))
+
+import pytest
+
+from score_benchmark import extract_final_answer, parse_options, score_locally, summarize
+
+def item(gold, solution, source="knowledge_base"):
+    return {"question": "q", "ground_truth": gold, "agent_solution": solution, "source": source}
+
+@pytest.mark.parametrize("solution,expected", [
+    ("Work...\n**Final Answer:** 72", "72"),
+    ("so \\boxed{\\frac{1}{2}} is it", "frac{1}{2}"),
+    ("Natalia sold 72 clips.\n#### 72", "72"),
+    ("The correct options are (A), (B) and (D).", "(A), (B) and (D)"),
+])
+def test_extract_final_answer(solution, expected):
+    assert extract_final_answer(solution) == expected
+
+def test_parse_options():
+    assert parse_options("(A), (B) and (D)") == frozenset("ABD")
+    assert parse_options("ACD") == frozenset("ACD")
+    assert parse_options("42") is None
+
+@pytest.mark.parametrize("gold,solution,verdict", [
+    ("6", "Final Answer: 6", "correct"),
+    ("1,200", "Final Answer: 1200", "correct"),
+    ("0.25", "Final Answer: 1/4", "correct"),
+    ("18", "Final Answer: $18", "correct"),
+    ("4", "Final Answer: x = 5", "incorrect"),
+    ("BD", "The answer is (B) and (D)", "correct"),
+    ("BD", "The answer is B", "incorrect"),
+    # More than one number, units or exponents: only the judge can tell.
+    ("6", "Final Answer: The area is 6 cm^2", "ambiguous"),
+    ("0.25", "The answer is 2.5 x 10^-1", "ambiguous"),
+    ("4", "Final Answer: 4 after 3 steps", "ambiguous"),
+    ("6", "I think it's six", "ambiguous"),
+])
+def test_score_locally(gold, solution, verdict):
+    assert score_locally(item(gold, solution))[0] == verdict
+
+def test_errors_count_against_accuracy():
+    rows = [
+        {"verdict": "correct", "scored_by": "local", "latency_seconds": 1.0},
+        {"verdict": "error", "scored_by": None, "latency_seconds": 1.0},
+    ]
+    summary = summarize(rows)
+    assert summary["accuracy"] == 0.5
+    assert summary["accuracy_excluding_errors"] == 1.0
+    assert summary["errors"] == 1
@@ -22,9 +22,8 @@ function Feedback({ message, onRefinement }) {
     setIsLoading(true);
     
     // 1. Create the feedback payload
+    // (the backend keeps the question and solution for each thread_id)
     const payload = {
-      question: message.question,
-      original_solution: message.solution,
       feedback_text: feedbackText,
       rating: rating,
       thread_id: message.thread_id
@@ -40,6 +40,8 @@ function Message({ message, onRefinement }) {
 
   const showFeedback = (
     message.source === 'knowledge_base' || 
+    message.source === 'knowledge_base_exact' ||
+    message.source === 'local_solver' ||
     message.source === 'web_search' ||
     message.source === 'direct_answer'
   );
@@ -22,7 +22,8 @@ export const askMathQuestion = async (question, student_id = "student1") => {
  */
 export const sendFeedback = async (payload) => {
   // Payload should be:
-  // { question, original_solution, feedback_text, rating, thread_id }
+  // { thread_id, rating, feedback_text }
+  // (question / original_solution are optional, the backend stores them per thread)
   const response = await API.post("/feedback/", payload);
   return response.data;
 };
@@ -26,7 +26,8 @@ def run_benchmark():
     print(f"Running benchmark on {len(dataset)} questions...")
     for item in tqdm(dataset):
         question = item['question']
-        ground_truth = item['answer']
+        # JEEBench calls the reference answer 'gold'; other datasets use 'answer'.
+        ground_truth = item['gold'] if 'gold' in item else item['answer']
         
         payload = {"question": question, "student_id": "benchmark_runner"}
         
@@ -67,7 +68,7 @@ def run_benchmark():
         json.dump(results, f, indent=2)
 
     print(f"Benchmark complete. Results saved to '{RESULTS_FILE}'.")
-    print("Next step: Run an 'LLM-as-a-judge' on the results file to score correctness.")
+    print("Next step: Run 'python scripts/score_benchmark.py' to score correctness.")
 
 if __name__ == "__main__":
     run_benchmark()
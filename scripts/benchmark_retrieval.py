@@ -0,0 +1,158 @@
+#Retrieval benchmark: flat search vs. topic-routed search as the KB grows
+import os
+import sys
+import json
+import time
+import random
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    Distance, VectorParams, PointStruct, KeywordIndexParams, KeywordIndexType,
+    Filter, FieldCondition, MatchValue
+)
+from sentence_transformers import SentenceTransformer
+from datasets import load_dataset
+from tqdm import tqdm
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from app.services.topics import classify_topic, TOPIC_ROUTING_MIN_CONFIDENCE
+
+# --- Config ---
+# Defaults to an in-process Qdrant; set BENCH_QDRANT_URL to benchmark a real server.
+BENCH_QDRANT_URL = os.environ.get("BENCH_QDRANT_URL", ":memory:")
+COLLECTION_NAME = "math_problems_bench"
+CORPUS_SIZES = [1000, 5000, 10000, 20000]
+NUM_QUERIES = 200
+RESULTS_FILE = "retrieval_benchmark_results.json"
+
+# GSM8K plus the MATH subjects, with their ground-truth topic label.
+CORPORA = [
+    ("gsm8k", "main", "question", "arithmetic"),
+    ("EleutherAI/hendrycks_math", "prealgebra", "problem", "arithmetic"),
+    ("EleutherAI/hendrycks_math", "number_theory", "problem", "arithmetic"),
+    ("EleutherAI/hendrycks_math", "algebra", "problem", "algebra"),
+    ("EleutherAI/hendrycks_math", "intermediate_algebra", "problem", "algebra"),
+    ("EleutherAI/hendrycks_math", "geometry", "problem", "geometry"),
+    ("EleutherAI/hendrycks_math", "counting_and_probability", "problem", "probability"),
+    ("EleutherAI/hendrycks_math", "precalculus", "problem", "calculus"),
+]
+
+def load_corpus():
+    items = []
+    for name, config, field, label in CORPORA:
+        print(f"Loading {name} ({config})...")
+        try:
+            dataset = load_dataset(name, config, split="train")
+        except Exception as e:
+            print(f"Skipping {name}/{config}: {e}")
+            continue
+        items.extend({"question": row[field], "label": label} for row in dataset)
+    random.Random(0).shuffle(items)
+    return items
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def build_collection(client, items, vectors, dim):
+    client.recreate_collection(
+        collection_name=COLLECTION_NAME,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+    )
+    client.create_payload_index(
+        collection_name=COLLECTION_NAME,
+        field_name="topic",
+        field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+    )
+    for start in range(0, len(items), 500):
+        client.upsert(
+            collection_name=COLLECTION_NAME,
+            points=[
+                PointStruct(id=i, vector=vectors[i], payload={"topic": items[i]["topic"], "label": items[i]["label"]})
+                for i in range(start, min(start + 500, len(items)))
+            ],
+            wait=True
+        )
+
+def run_queries(client, items, vectors, query_ids, routed):
+    """
+    Queries are held-out questions (not in the collection). Returns
+    latency percentiles, how often the top hit has the query's true
+    topic, and the top hit ids (to compare routed against flat search).
+    """
+    latencies, top_ids, topic_hits, scores, fallbacks = [], [], 0, [], 0
+    for i in query_ids:
+        topic, confidence = classify_topic(items[i]["question"])
+        query_filter = None
+        if routed and confidence >= TOPIC_ROUTING_MIN_CONFIDENCE:
+            query_filter = Filter(must=[FieldCondition(key="topic", match=MatchValue(value=topic))])
+
+        start = time.perf_counter()
+        result = client.search(
+            collection_name=COLLECTION_NAME, query_vector=vectors[i],
+            query_filter=query_filter, limit=1
+        )
+        if not result and query_filter is not None:
+            fallbacks += 1
+            result = client.search(collection_name=COLLECTION_NAME, query_vector=vectors[i], limit=1)
+        latencies.append(time.perf_counter() - start)
+
+        top_ids.append(result[0].id if result else None)
+        if result:
+            scores.append(result[0].score)
+            topic_hits += int(result[0].payload["label"] == items[i]["label"])
+
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "topic_precision": topic_hits / len(query_ids),
+        "mean_top_score": sum(scores) / len(scores) if scores else 0.0,
+        "fallbacks": fallbacks,
+    }, top_ids
+
+def run_benchmark():
+    items = load_corpus()
+    if len(items) <= NUM_QUERIES:
+        print("Corpus too small (or not loaded). Exiting.")
+        return
+
+    print(f"Tagging {len(items)} questions with the local topic classifier...")
+    for item in items:
+        item["topic"], _ = classify_topic(item["question"])
+    topic_accuracy = sum(item["topic"] == item["label"] for item in items) / len(items)
+    print(f"Classifier agreement with dataset labels: {topic_accuracy:.1%}")
+
+    print("Encoding corpus (all-MiniLM-L6-v2)...")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    vectors = model.encode([item["question"] for item in items], batch_size=128, show_progress_bar=True).tolist()
+    dim = len(vectors[0])
+
+    client = QdrantClient(BENCH_QDRANT_URL) if BENCH_QDRANT_URL == ":memory:" else QdrantClient(url=BENCH_QDRANT_URL)
+
+    # The last NUM_QUERIES questions are held out as queries.
+    query_ids = list(range(len(items) - NUM_QUERIES, len(items)))
+    max_corpus = len(items) - NUM_QUERIES
+
+    report = {"classifier_agreement": topic_accuracy, "sizes": []}
+    for size in tqdm([s for s in CORPUS_SIZES if s <= max_corpus] or [max_corpus]):
+        build_collection(client, items[:size], vectors, dim)
+        flat, flat_ids = run_queries(client, items, vectors, query_ids, routed=False)
+        routed, routed_ids = run_queries(client, items, vectors, query_ids, routed=True)
+        # Share of queries where routing returned the same top hit as a full search.
+        routed["same_top_hit_as_flat"] = sum(a == b for a, b in zip(flat_ids, routed_ids)) / len(query_ids)
+        report["sizes"].append({"corpus_size": size, "flat": flat, "routed": routed})
+        print(f"\n{size:>6} points | flat p50 {flat['p50_ms']:.2f}ms p95 {flat['p95_ms']:.2f}ms "
+              f"topic@1 {flat['topic_precision']:.1%} | routed p50 {routed['p50_ms']:.2f}ms "
+              f"p95 {routed['p95_ms']:.2f}ms topic@1 {routed['topic_precision']:.1%} "
+              f"same-hit {routed['same_top_hit_as_flat']:.1%} (fallbacks: {routed['fallbacks']})")
+
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Retrieval benchmark complete. Results saved to '{RESULTS_FILE}'.")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,23 +1,36 @@
 import os
+import sys
 import json
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import (
+    Distance, VectorParams, PointStruct, KeywordIndexParams, KeywordIndexType
+)
 from sentence_transformers import SentenceTransformer
 from datasets import load_dataset
 import uuid
 from dotenv import load_dotenv
 from tqdm import tqdm # For a progress bar
 
+# Load .env file (API keys, EMBEDDING_CACHE_DIR) before the backend modules read it
+load_dotenv()
+
+# Reuse the backend's topic classifier and embedding cache so ingestion and search agree.
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from app.services.topics import classify_topic, estimate_difficulty
+from app.services.kb_answers import question_hash
+from app.core.embedding_cache import EmbeddingCache
+
 # --- Config ---
 COLLECTION_NAME = "math_problems"
 # Use GSM8K (General School Math) dataset from Hugging Face
 DATASET_NAME = "gsm8k"
 DATASET_CONFIG = "main" # Use the main config
 DATASET_SPLIT = "train[:1000]" # Ingest first 1000 problems
+DATASET_TAG = "gsm8k" # Stored in the payload so corpora can be told apart
 
 def ingest_to_vectordb():
-    # Load .env file to get API keys
-    load_dotenv()
     QDRANT_URL = os.environ.get("VECTORDB_URL")
     QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 
@@ -36,6 +49,7 @@ def ingest_to_vectordb():
     print("Loading embedding model (all-MiniLM-L6-v2)...")
     model = SentenceTransformer("all-MiniLM-L6-v2")
     embedding_dim = model.get_sentence_embedding_dimension()
+    embedding_cache = EmbeddingCache(model, "all-MiniLM-L6-v2")
     print(f"Model loaded. Embedding dimension: {embedding_dim}")
 
     # --- Load Dataset ---
@@ -43,37 +57,75 @@ def ingest_to_vectordb():
     dataset = load_dataset(DATASET_NAME, DATASET_CONFIG, split=DATASET_SPLIT)
     
     # --- Create Collection in Qdrant ---
+    # Created only if missing: re-runs update points in place (ids are
+    # derived from the question) and keep answers the API has learned.
     try:
-        client.recreate_collection(
+        if client.collection_exists(COLLECTION_NAME):
+            print(f"Cloud Collection '{COLLECTION_NAME}' exists. Updating it in place.")
+        else:
+            client.create_collection(
+                collection_name=COLLECTION_NAME,
+                vectors_config=VectorParams(size=embedding_dim, distance=Distance.COSINE),
+            )
+            print(f"Cloud Collection '{COLLECTION_NAME}' created.")
+    except Exception as e:
+        print(f"Collection creation failed: {e}")
+
+    # --- Payload Indexes ---
+    # `topic` is a tenant index: Qdrant stores each topic's points together,
+    # so a topic-filtered search only touches that shard of the corpus.
+    try:
+        client.create_payload_index(
             collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=embedding_dim, distance=Distance.COSINE),
+            field_name="topic",
+            field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
         )
-        print(f"Cloud Collection '{COLLECTION_NAME}' created.")
+        # `question_hash` backs the exact-match fast path in the API.
+        for field in ("difficulty", "dataset", "question_hash"):
+            client.create_payload_index(
+                collection_name=COLLECTION_NAME,
+                field_name=field,
+                field_schema=KeywordIndexType.KEYWORD,
+            )
+        print("Payload indexes created (topic, difficulty, dataset, question_hash).")
     except Exception as e:
-        print(f"Collection creation failed (it might already exist): {e}")
+        print(f"Payload index creation failed: {e}")
 
     # --- Encode and Ingest Data ---
     print(f"Encoding and ingesting {len(dataset)} documents...")
     points_batch = []
+    topic_counts = {}
+
+    # We embed the questions for searching. Questions embedded by a
+    # previous run (or by the API) come from the cache.
+    vectors = embedding_cache.encode(dataset['question'], batch_size=64, show_progress_bar=True)
     
-    for item in tqdm(dataset):
-        # We embed the question for searching
-        vector = model.encode(item['question']).tolist()
+    for item, vector in tqdm(zip(dataset, vectors), total=len(dataset)):
+        vector = vector.tolist()
         
         # We store the question, answer, and steps in the payload
         answer_parts = item['answer'].split("####")
         steps = answer_parts[0].strip()
         answer = answer_parts[1].strip() if len(answer_parts) > 1 else steps
         
+        digest = question_hash(item['question'])
+        topic, _ = classify_topic(item['question'])
+        topic_counts[topic] = topic_counts.get(topic, 0) + 1
+        
         payload = {
             "question": item['question'],
             "answer": answer,
-            "steps": steps
+            "steps": steps,
+            "topic": topic,
+            "difficulty": estimate_difficulty(item['question'], steps),
+            "dataset": DATASET_TAG,
+            "question_hash": digest
         }
         
         points_batch.append(
             PointStruct(
-                id=str(uuid.uuid4()),
+                # Same question, same id: re-running ingestion overwrites, never duplicates.
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{DATASET_TAG}:{digest}")),
                 vector=vector,
                 payload=payload
             )
@@ -97,6 +149,10 @@ def ingest_to_vectordb():
         )
 
     print(f"Ingestion complete for {COLLECTION_NAME}.")
+    print(f"Points per topic: {topic_counts}")
+    stats = embedding_cache.stats()
+    print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"(hit rate {stats['hit_rate']:.1%}, ~{stats['saved_encode_seconds']:.1f}s of encoding saved).")
 
 if __name__ == "__main__":
     ingest_to_vectordb()
@@ -1,6 +1,10 @@
 import os
 import sys
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import dspy
 
 # --- Setup Project Root ---
@@ -16,53 +20,97 @@ if BACKEND_DIR not in sys.path:
 try:
 
     from backend.app.core.clients import dspy_gemini_lm 
-    from backend.app.services.dspy_feedback import RefinementModule, RefineSolutionSignature
+    from backend.app.services.dspy_feedback import RefinementModule, RefineSolutionSignature, signature_mismatch
 except ImportError as e:
     print(f"Error: {e}")
     print("Please make sure you are running this script from the root 'math-professor-project' folder,")
     print("or that your backend app structure is correct.")
     sys.exit(1)
 
+# --- Config ---
+FEEDBACK_LOG_PATH = "backend/feedback_log.jsonl"
+OUTPUT_PATH = "backend/optimized_refiner_module.json"
+# Remembers how far into the feedback log the last successful run got.
+CHECKPOINT_PATH = "backend/optimize_checkpoint.json"
+# One JSON verdict per line, keyed by a hash of (original, feedback, refined).
+JUDGE_CACHE_PATH = "backend/judge_cache.jsonl"
+MAX_BOOTSTRAPPED_DEMOS = 2
+NUM_THREADS = int(os.environ.get("OPTIMIZE_NUM_THREADS", "8"))
+
+# --- 0. Checkpoint (incremental runs) ---
+
+def load_checkpoint(checkpoint_path=CHECKPOINT_PATH):
+    """
+    Returns the byte offset in the feedback log that the last
+    successful run stopped at (0 if there was no previous run).
+    """
+    try:
+        with open(checkpoint_path, 'r') as f:
+            return json.load(f).get("offset", 0)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+
+def save_checkpoint(offset, checkpoint_path=CHECKPOINT_PATH):
+    with open(checkpoint_path, 'w') as f:
+        json.dump({"offset": offset, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f)
+
 # --- 1. Load the Feedback Log ---
 
-def load_feedback_log(log_file_path="backend/feedback_log.jsonl"):
+def load_feedback_log(log_file_path=FEEDBACK_LOG_PATH, start_offset=0):
     """
     Loads the feedback log and filters for useful examples.
     We are looking for "bad" ratings where the user provided
     a "ground truth" correction.
+    Only entries written after `start_offset` are read.
+    Returns (trainset, end_offset).
     """
-    print(f"Loading feedback from {log_file_path}...")
+    print(f"Loading feedback from {log_file_path} (from byte {start_offset})...")
     trainset = []
+    end_offset = start_offset
     try:
-        with open(log_file_path, 'r') as f:
-            for line in f:
-                entry = json.loads(line)
+        with open(log_file_path, 'rb') as f:
+            if start_offset > os.path.getsize(log_file_path):
+                # The log was truncated/rotated: start over.
+                print("Feedback log is smaller than the checkpoint. Reading it from the start.")
+                start_offset = 0
+            f.seek(start_offset)
+            end_offset = start_offset
+            for raw_line in f:
+                if not raw_line.endswith(b"\n"):
+                    # Half-written line from a live server, pick it up next run.
+                    break
+                end_offset += len(raw_line)
+                try:
+                    entry = json.loads(raw_line)
+                except json.JSONDecodeError:
+                    continue
                 
                 # We only want to train on "bad" feedback where the
                 # user told us *why* it was bad.
-                if entry.get("rating") == "bad" and entry.get("feedback_text"):
+                if entry.get("rating") == "bad" and entry.get("feedback_text") and entry.get("original_solution"):
                     
                     example = dspy.Example(
                         question=entry["question"],
                         original_solution=entry["original_solution"],
                         user_feedback=entry["feedback_text"],
+                        context=entry.get("context") or "", # Older log entries have no context
                         refined_solution=entry["feedback_text"] # The user's text is our "gold" answer
-                    ).with_inputs("question", "original_solution", "user_feedback")
+                    ).with_inputs("question", "original_solution", "user_feedback", "context")
                     
                     trainset.append(example)
                     
     except FileNotFoundError:
         print(f"Error: Could not find '{log_file_path}'.")
         print("Please run the web app and submit some 'bad' feedback first.")
-        return None
+        return None, start_offset
     
     if not trainset:
-        print("No 'bad' feedback entries found in the log.")
+        print("No new 'bad' feedback entries found in the log.")
         print("Please use the app and submit 'bad' feedback with a correction.")
-        return None
+        return None, end_offset
         
-    print(f"Loaded {len(trainset)} 'bad' feedback examples to use for training.")
-    return trainset
+    print(f"Loaded {len(trainset)} new 'bad' feedback examples to use for training.")
+    return trainset, end_offset
 
 # --- 2. Define the Evaluation Metric ---
 # We'll use an "LLM-as-a-judge" to score the new, refined answers.
@@ -81,16 +129,69 @@ class AssessRefinement(dspy.Signature):
         desc="A score from 1 to 5. 5 means the feedback was perfectly incorporated. 1 means it was ignored."
     )
 
-def llm_as_judge_metric(gold, pred, trace=None):
+class JudgeCache:
     """
-    DSPy metric function that uses an LLM to judge the refined output.
-    'gold' is the dspy.Example (our training data).
-    'pred' is the prediction from our module.
+    On-disk cache of judge verdicts, so pairs judged in a previous run
+    (or earlier in this one) never hit Gemini again.
+    Stored as append-only JSON lines: {"key": ..., "score": ..., "assessment": ...}
     """
-    original = gold.original_solution
-    feedback = gold.user_feedback
-    refined = pred.refined_solution
-    
+    def __init__(self, path=JUDGE_CACHE_PATH):
+        self.path = path
+        self.verdicts = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.verdicts[entry["key"]] = entry
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+        print(f"Judge cache: {len(self.verdicts)} verdicts loaded from {path}.")
+
+    @staticmethod
+    def make_key(original, feedback, refined):
+        digest = hashlib.sha256()
+        for part in (original, feedback, refined):
+            digest.update((part or "").encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.verdicts.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key, score, assessment):
+        entry = {"key": key, "score": score, "assessment": assessment}
+        with self._lock:
+            self.verdicts[key] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+judge_cache = JudgeCache()
+
+def judge_refinement(original, feedback, refined):
+    """
+    Returns the cached judge verdict for this triple, calling Gemini
+    only if it has never been judged before. Verdicts whose score can't
+    be parsed are returned with score 0 but not cached, so a malformed
+    or truncated reply is retried on the next run.
+    """
+    key = JudgeCache.make_key(original, feedback, refined)
+    entry = judge_cache.get(key)
+    if entry is not None:
+        return entry
+
     # simple Predict module for the judge
     judge = dspy.Predict(AssessRefinement)
     result = judge(
@@ -98,22 +199,75 @@ def llm_as_judge_metric(gold, pred, trace=None):
         user_feedback=feedback,
         refined_solution=refined
     )
-    
 
     score = 0
     try:
         score = int(result.assessment.split()[0]) 
     except:
         pass 
+
+    if not 1 <= score <= 5:
+        print(f"--- Judge: Unparseable verdict, not caching: {result.assessment[:80]!r} ---")
+        return {"key": key, "score": 0, "assessment": result.assessment}
+    return judge_cache.put(key, score, result.assessment)
+
+def llm_as_judge_metric(gold, pred, trace=None):
+    """
+    DSPy metric function that uses an LLM to judge the refined output.
+    'gold' is the dspy.Example (our training data).
+    'pred' is the prediction from our module.
+    """
+    verdict = judge_refinement(
+        gold.original_solution,
+        gold.user_feedback,
+        pred.refined_solution
+    )
+    score = verdict["score"]
         
     if trace is None: 
         return score >= 4 
         
 
     trace.metric_score = score
-    trace.metric_feedback = result.assessment
+    trace.metric_feedback = verdict["assessment"]
     return score >= 4
 
+def prewarm_judge_cache(teacher, trainset, num_threads=NUM_THREADS):
+    """
+    BootstrapFewShot evaluates candidates one at a time. We run the
+    teacher and the judge for every example up front, on a bounded
+    thread pool, so the optimizer's own (serial) metric calls are
+    served from the LM cache and the judge cache.
+    Returns how many examples already pass the metric.
+    """
+    def evaluate(example):
+        try:
+            pred = teacher(**example.inputs())
+            return llm_as_judge_metric(example, pred)
+        except Exception as e:
+            print(f"Prewarm failed for one example: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        results = list(pool.map(evaluate, trainset))
+    return sum(1 for passed in results if passed)
+
+def merge_demos(optimized_module, previous_module, max_demos=MAX_BOOTSTRAPPED_DEMOS):
+    """
+    The optimizer only saw the new feedback, so keep the previous
+    run's demos as well: new demos first, then the old ones, capped.
+    """
+    previous = dict(previous_module.named_predictors())
+    for name, predictor in optimized_module.named_predictors():
+        old_demos = previous[name].demos if name in previous else []
+        merged, seen = [], set()
+        for demo in list(predictor.demos) + list(old_demos):
+            key = json.dumps(dict(demo), sort_keys=True, default=str)
+            if key not in seen:
+                seen.add(key)
+                merged.append(demo)
+        predictor.demos = merged[:max_demos]
+
 
 # --- 3. Run the Optimization ---
 
@@ -122,9 +276,16 @@ def main():
         print("DSPy client not configured. Exiting.")
         return
 
-    # 1. Load data
-    trainset = load_feedback_log()
+    run_start = time.perf_counter()
+
+    # 1. Load only the feedback added since the last run
+    start_offset = load_checkpoint()
+    trainset, end_offset = load_feedback_log(start_offset=start_offset)
     if not trainset:
+        if end_offset != start_offset:
+            # Nothing trainable, but don't re-read those lines next time.
+            save_checkpoint(end_offset)
+        print(f"Total wall-clock time: {time.perf_counter() - run_start:.1f}s")
         return
 
     # 2. Set up the Optimizer
@@ -132,35 +293,73 @@ def main():
     # few-shot examples (demos) for our prompt.
     optimizer = dspy.BootstrapFewShot(
         metric=llm_as_judge_metric,
-        max_bootstrapped_demos=2 # Start with 2 good examples
+        max_bootstrapped_demos=MAX_BOOTSTRAPPED_DEMOS # Start with 2 good examples
     )
     
     # 3. Define the "student" module we want to teach
     # This is the *un-optimized* module from our app
     student_module = RefinementModule()
+
+    # Warm start: the previously optimized module is the teacher,
+    # so its demos guide the new bootstrapping. A module loaded from JSON
+    # isn't marked compiled, and BootstrapFewShot would then replace it
+    # with a fresh LabeledFewShot teacher, dropping its demos (and making
+    # the prompts differ from the prewarm below, so nothing is reused).
+    teacher_module = RefinementModule()
+    try:
+        with open(OUTPUT_PATH, 'r') as f:
+            mismatch = signature_mismatch(json.load(f))
+        if mismatch:
+            print(f"Previous module doesn't match the current signature ({mismatch}). Starting from default prompts.")
+        else:
+            teacher_module.load(OUTPUT_PATH)
+            teacher_module._compiled = True
+            print(f"Warm-starting from {OUTPUT_PATH}.")
+    except FileNotFoundError:
+        print("No previous optimized module found. Starting from default prompts.")
+
+    # 4. Judge every candidate concurrently before compiling
+    prewarm_start = time.perf_counter()
+    passing = prewarm_judge_cache(teacher_module, trainset)
+    print(f"Prewarm: {passing}/{len(trainset)} examples pass the judge "
+          f"({time.perf_counter() - prewarm_start:.1f}s, {NUM_THREADS} threads).")
     
     print("\nStarting optimization... This will take a few minutes...")
     print(f"Training on {len(trainset)} examples.")
     
-    # 4. Run the compilation (optimization)
+    # 5. Run the compilation (optimization)
     # This will test different prompts to find what works best
+    compile_start = time.perf_counter()
+    hits_before, misses_before = judge_cache.hits, judge_cache.misses
     optimized_module = optimizer.compile(
         student=student_module,
+        teacher=teacher_module,
         trainset=trainset
     )
+    merge_demos(optimized_module, teacher_module)
     
     print("\n--- Optimization Complete! ---")
+    print(f"Compile time: {time.perf_counter() - compile_start:.1f}s")
+    # Compile-phase judge calls should be hits if the prewarm was reused.
+    print(f"Judge cache during compile: {judge_cache.hits - hits_before} hits, "
+          f"{judge_cache.misses - misses_before} misses.")
 
-    # 5. Save the new, optimized module
-    output_path = "backend/optimized_refiner_module.json"
-    optimized_module.save(output_path)
+    # 6. Save the new, optimized module and advance the checkpoint
+    # Write to a temp file and rename, so a running server's watcher
+    # never sees a half-written module.
+    tmp_path = OUTPUT_PATH.replace(".json", ".tmp.json")
+    optimized_module.save(tmp_path)
+    os.replace(tmp_path, OUTPUT_PATH)
+    save_checkpoint(end_offset)
     
-    print(f"Saved optimized module to: {output_path}")
+    print(f"Saved optimized module to: {OUTPUT_PATH}")
+    print(f"Judge cache: {judge_cache.hits} hits, {judge_cache.misses} misses.")
+    print(f"Total wall-clock time: {time.perf_counter() - run_start:.1f}s")
     
     print("\n--- Next Steps ---")
-    print("To use this, you would now update 'backend/app/services/dspy_feedback.py' to load this file:")
-    print("1. Add: `dspy_refiner.load(path='backend/optimized_refiner_module.json')`")
-    print("This script has NOT changed your live code.")
+    print("A running server picks this file up automatically (see GET /refiner/version).")
+    print("Use POST /refiner/rollback (X-Admin-Token) to go back to the previous version;")
+    print("a rollback stays pinned on every worker until POST /refiner/reload.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,298 @@
+#Scores benchmark_results.json: local answer matching first, LLM judge only for ambiguous items
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# --- Config ---
+RESULTS_FILE = "benchmark_results.json"
+REPORT_FILE = "benchmark_report.json"
+# Verdicts from previous runs, one JSON object per line.
+JUDGE_CACHE_FILE = "judge_verdicts.jsonl"
+JUDGE_MODEL = "gemini-2.5-flash"
+JUDGE_BATCH_SIZE = 8      # items per judge prompt
+JUDGE_NUM_THREADS = 4     # judge prompts in flight
+USE_LLM_JUDGE = os.environ.get("USE_LLM_JUDGE", "1") != "0"
+
+# Numeric answers are usually rounded to 2 decimals in JEEBench.
+ABS_TOL = 0.01
+REL_TOL = 1e-3
+
+# --- 1. Final answer extraction ---
+
+_NUMBER_RE = re.compile(r"-?\d[\d,]*(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)?|-?\.\d+")
+_FINAL_MARKERS = [
+    re.compile(r"\\boxed\{([^{}]*(?:\{[^{}]*\}[^{}]*)*)\}"),
+    re.compile(r"####\s*(.+)"),
+    re.compile(r"final answer\s*(?:is|:)?\s*[:*]*\s*(.+)", re.IGNORECASE),
+    re.compile(r"(?:correct )?(?:answer|option)s?\s*(?:is|are|:)\s*[:*]*\s*(.+)", re.IGNORECASE),
+]
+
+def _clean(text: str) -> str:
+    text = text.strip().strip("*").strip()
+    text = re.sub(r"\\text\{([^}]*)\}", r"\1", text)
+    text = text.replace("$", "").replace("\\", "")
+    return text.strip().rstrip(".").strip()
+
+def extract_final_answer(text: str) -> str | None:
+    """
+    Pulls the final answer out of a solution (or a ground-truth string):
+    \\boxed{...}, the GSM8K "#### 72" convention, "Final Answer: ...",
+    then "answer is ..." -- the last match of the first marker found wins.
+    """
+    if not text:
+        return None
+    for marker in _FINAL_MARKERS:
+        matches = marker.findall(text)
+        if matches:
+            candidate = _clean(matches[-1].splitlines()[0])
+            if candidate:
+                return candidate
+    return None
+
+def parse_options(text: str) -> frozenset | None:
+    """ "A", "(B)", "A, C and D", "ACD" -> frozenset of letters, else None."""
+    text = re.sub(r"\b(?:and|or|options?)\b", " ", _clean(text), flags=re.IGNORECASE)
+    if re.fullmatch(r"[\s(),&A-D]+", text) and re.search(r"[A-D]", text):
+        return frozenset(re.findall(r"[A-D]", text))
+    return None
+
+def parse_number(text: str) -> float | None:
+    matches = _NUMBER_RE.findall(_clean(text))
+    if not matches:
+        return None
+    value = matches[-1].replace(",", "").replace(" ", "")
+    try:
+        if "/" in value:
+            numerator, denominator = value.split("/")
+            return float(numerator) / float(denominator)
+        return float(value)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def parse_exact_number(text: str) -> float | None:
+    """
+    Like parse_number, but only when the text *is* a number (optionally
+    "x = ..."). Anything else -- several numbers, units, "2.5 x 10^-1" --
+    returns None, because picking one number out of it is a guess.
+    """
+    text = re.sub(r"^[A-Za-z]\w*\s*=\s*", "", _clean(text))
+    if not _NUMBER_RE.fullmatch(text.strip()):
+        return None
+    return parse_number(text)
+
+def numbers_equal(a: float, b: float) -> bool:
+    return abs(a - b) <= max(ABS_TOL, REL_TOL * max(abs(a), abs(b)))
+
+# --- 2. Local scoring ---
+
+def score_locally(item: dict) -> tuple[str, str | None]:
+    """
+    Returns (verdict, extracted_answer), verdict in
+    "correct" | "incorrect" | "ambiguous" | "error".
+    Only "ambiguous" items go to the LLM judge.
+    """
+    if item.get("source") == "error":
+        return "error", None
+
+    gold_text = str(item["ground_truth"])
+    gold = extract_final_answer(gold_text) or _clean(gold_text)
+    predicted = extract_final_answer(item["agent_solution"])
+
+    gold_options = parse_options(gold)
+    if gold_options:
+        # Multiple-choice: compare the set of chosen letters.
+        predicted_options = parse_options(predicted) if predicted else None
+        if predicted_options is None:
+            return "ambiguous", predicted
+        return ("correct" if predicted_options == gold_options else "incorrect"), predicted
+
+    gold_number = parse_number(gold)
+    if gold_number is not None:
+        if predicted is None:
+            return "ambiguous", None
+        predicted_number = parse_exact_number(predicted)
+        if predicted_number is None:
+            # Units, exponents or several numbers: let the judge decide.
+            return "ambiguous", predicted
+        return ("correct" if numbers_equal(predicted_number, gold_number) else "incorrect"), predicted
+
+    # Symbolic / free-text gold answer: only an exact match is trusted locally.
+    if predicted is not None and predicted.replace(" ", "").lower() == gold.replace(" ", "").lower():
+        return "correct", predicted
+    return "ambiguous", predicted
+
+# --- 3. Batched, cached LLM judge (ambiguous items only) ---
+
+JUDGE_PROMPT = """You are grading a math benchmark. For each item, decide whether the
+agent's solution reaches the same final answer as the ground truth
+(equivalent forms count as correct; the reasoning is not graded).
+
+Respond with ONLY a JSON list of objects: [{{"id": <id>, "correct": true|false}}, ...]
+
+Items:
+{items}
+"""
+
+class VerdictCache:
+    def __init__(self, path=JUDGE_CACHE_FILE):
+        self.path = path
+        self.verdicts = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.verdicts[entry["key"]] = entry["correct"]
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def make_key(item: dict) -> str:
+        digest = hashlib.sha256()
+        for part in (item["question"], str(item["ground_truth"]), item["agent_solution"]):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def put(self, key: str, correct: bool):
+        with self._lock:
+            self.verdicts[key] = correct
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({"key": key, "correct": correct}) + "\n")
+
+def _parse_judge_json(text: str):
+    if "```" in text:
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    return json.loads(text.strip())
+
+def judge_batch(llm, batch: list) -> dict:
+    """One judge call for a batch of (key, item). Returns {key: correct}."""
+    items = "\n\n".join(
+        f"### id: {i}\nQuestion: {item['question'][:2000]}\n"
+        f"Ground truth: {item['ground_truth']}\n"
+        f"Agent solution (last part): {item['agent_solution'][-2000:]}"
+        for i, (_, item) in enumerate(batch)
+    )
+    response = llm.invoke(JUDGE_PROMPT.format(items=items))
+    content = response.content if hasattr(response, 'content') else str(response)
+    results = {}
+    for entry in _parse_judge_json(content):
+        index = int(entry["id"])
+        if 0 <= index < len(batch):
+            results[batch[index][0]] = bool(entry["correct"])
+    return results
+
+def run_llm_judge(items: list, cache: VerdictCache) -> dict:
+    """Judges items not already in the cache, in concurrent batches. Returns {key: correct}."""
+    keyed = [(VerdictCache.make_key(item), item) for item in items]
+    verdicts = {key: cache.verdicts[key] for key, _ in keyed if key in cache.verdicts}
+    pending = [(key, item) for key, item in keyed if key not in verdicts]
+    print(f"LLM judge: {len(verdicts)} cached, {len(pending)} to judge.")
+    if not pending:
+        return verdicts
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    llm = ChatGoogleGenerativeAI(model=JUDGE_MODEL, google_api_key=os.environ.get("GOOGLE_API_KEY"), temperature=0.0)
+
+    batches = [pending[i:i + JUDGE_BATCH_SIZE] for i in range(0, len(pending), JUDGE_BATCH_SIZE)]
+
+    def judge(batch):
+        try:
+            return judge_batch(llm, batch)
+        except Exception as e:
+            print(f"Judge batch failed ({len(batch)} items left ambiguous): {e}")
+            return {}
+
+    with ThreadPoolExecutor(max_workers=JUDGE_NUM_THREADS) as pool:
+        for results in pool.map(judge, batches):
+            for key, correct in results.items():
+                cache.put(key, correct)
+                verdicts[key] = correct
+    return verdicts
+
+# --- 4. Report ---
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def summarize(rows: list) -> dict:
+    scored = [r for r in rows if r["verdict"] in ("correct", "incorrect")]
+    # A failed agent run is a wrong answer; leaving it out would inflate accuracy.
+    attempted = [r for r in rows if r["verdict"] in ("correct", "incorrect", "error")]
+    correct = sum(r["verdict"] == "correct" for r in scored)
+    latencies = [r["latency_seconds"] for r in rows]
+    return {
+        "count": len(rows),
+        "scored": len(scored),
+        "accuracy": correct / len(attempted) if attempted else None,
+        "accuracy_excluding_errors": correct / len(scored) if scored else None,
+        "ambiguous": sum(r["verdict"] == "ambiguous" for r in rows),
+        "errors": sum(r["verdict"] == "error" for r in rows),
+        "scored_by_llm": sum(r["scored_by"] == "llm_judge" for r in rows),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+    }
+
+def score_benchmark():
+    load_dotenv()
+    start = time.perf_counter()
+    try:
+        with open(RESULTS_FILE, 'r') as f:
+            results = json.load(f)
+    except FileNotFoundError:
+        print(f"Error: '{RESULTS_FILE}' not found. Run scripts/benchmark.py first.")
+        return
+
+    rows = []
+    for item in results:
+        verdict, extracted = score_locally(item)
+        rows.append({**item, "extracted_answer": extracted, "verdict": verdict,
+                     "scored_by": "local" if verdict in ("correct", "incorrect") else None})
+
+    ambiguous = [r for r in rows if r["verdict"] == "ambiguous"]
+    print(f"Local scoring: {len(rows) - len(ambiguous)} of {len(rows)} items decided without an LLM.")
+
+    if ambiguous and USE_LLM_JUDGE:
+        verdicts = run_llm_judge(ambiguous, VerdictCache())
+        for row in ambiguous:
+            key = VerdictCache.make_key(row)
+            if key in verdicts:
+                row["verdict"] = "correct" if verdicts[key] else "incorrect"
+                row["scored_by"] = "llm_judge"
+
+    by_source = {}
+    for row in rows:
+        by_source.setdefault(row["source"], []).append(row)
+
+    report = {
+        "overall": summarize(rows),
+        "by_source": {source: summarize(group) for source, group in sorted(by_source.items())},
+        "items": rows,
+    }
+    with open(REPORT_FILE, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'source':<22}{'n':>5}{'acc':>8}{'p50 s':>8}{'p95 s':>8}{'llm':>6}{'amb':>6}")
+    for source, summary in [("ALL", report["overall"])] + list(report["by_source"].items()):
+        accuracy = f"{summary['accuracy']:.1%}" if summary["accuracy"] is not None else "-"
+        print(f"{source:<22}{summary['count']:>5}{accuracy:>8}{summary['latency_p50'] or 0:>8.2f}"
+              f"{summary['latency_p95'] or 0:>8.2f}{summary['scored_by_llm']:>6}{summary['ambiguous']:>6}")
+    print(f"\nScoring took {time.perf_counter() - start:.1f}s. Report saved to '{REPORT_FILE}'.")
+
+if __name__ == "__main__":
+    score_benchmark()